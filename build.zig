@@ -181,6 +181,8 @@ fn addCopyDirectory(
         const new_src = b.path(new_src_path);
         switch (entry.kind) {
             .file => {
+                // Exporter caches (see one_bit/export_cache.py) live next to the assets
+                if (std.mem.endsWith(u8, entry.name, ".cache")) continue;
                 _ = wf.addCopyFile(new_src, new_dest_path);
             },
             .directory => {
@@ -0,0 +1,89 @@
+import base64
+
+import numpy
+
+from one_bit import bitpack
+
+# Packing of small static bitmaps into shared atlas sheets.
+#
+# On their own every bitmap is padded to a multiple of 32 pixels wide and is
+# a separate LCDBitmap, so small sprites waste most of their rowbytes. In
+# atlas mode they are shelf packed into a few sheets (which are a multiple
+# of 32 wide so there is no padding) and referenced by sheet + rect.
+#
+# The packing only depends on the sizes (in slot order), that way the library
+# export and the level builder (through library_to_pts) always agree on where
+# every bitmap ended up without having to pass the layout around.
+#
+# Rects are [x, y, w, h] in the sheet's stored rows, like the volumes the
+# first stored row is the bottom row and the Playdate draws them flipped in Y.
+
+DEFAULT_SHEET_SIZE = 256
+DEFAULT_MAX_BITMAP = 64
+
+
+def is_candidate(static, res, max_bitmap=DEFAULT_MAX_BITMAP):
+    return bool(static) and max(res) <= max_bitmap
+
+
+def pack(sizes, sheet_size=DEFAULT_SHEET_SIZE):
+    # Shelf packing, tallest first. Returns ([sheet, x, y, w, h] per size in
+    # the given order, [(sheet_width, sheet_height)] per sheet).
+    sheet_width = bitpack.padded_width(sheet_size)
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0], i))
+
+    rects = [None] * len(sizes)
+    sheets = []
+    shelf_x = shelf_y = shelf_height = 0
+    for i in order:
+        w, h = sizes[i]
+        if w > sheet_width or h > sheet_size:
+            raise ValueError(f"{w}x{h} bitmap doesn't fit a {sheet_size} atlas")
+        if not sheets or shelf_x + w > sheet_width:
+            # Start a new shelf, or a new sheet when it's full
+            shelf_y += shelf_height
+            shelf_x = shelf_height = 0
+            if not sheets or shelf_y + h > sheet_size:
+                sheets.append([0, 0])
+                shelf_y = 0
+        rects[i] = [len(sheets) - 1, shelf_x, shelf_y, w, h]
+        shelf_x += w
+        shelf_height = max(shelf_height, h)
+        # Sheets shrink to what is used, still padded to 32 pixels
+        sheets[-1][0] = max(sheets[-1][0], bitpack.padded_width(shelf_x))
+        sheets[-1][1] = max(sheets[-1][1], shelf_y + h)
+    return rects, [tuple(s) for s in sheets]
+
+
+def _unpack(encoded, res):
+    packed = numpy.frombuffer(base64.urlsafe_b64decode(encoded), numpy.uint8)
+    return numpy.unpackbits(packed.reshape(res[1], -1), axis=-1, count=res[0])
+
+
+def build_sheets(items, rects, sheets):
+    # items is a list of (res, img, img_mask | None) encoded strings in slot
+    # order. Returns the (img, img_mask) encoded strings per sheet, unmasked
+    # items are opaque over their whole rect.
+    imgs = [numpy.zeros((h, w), dtype=numpy.uint8) for w, h in sheets]
+    sheet_masks = [numpy.zeros((h, w), dtype=numpy.uint8) for w, h in sheets]
+    for (res, img, img_mask), (sheet, x, y, w, h) in zip(items, rects):
+        imgs[sheet][y : y + h, x : x + w] = _unpack(img, res)
+        if img_mask is None:
+            sheet_masks[sheet][y : y + h, x : x + w] = 1
+        else:
+            sheet_masks[sheet][y : y + h, x : x + w] = _unpack(img_mask, res)
+    return [
+        (
+            bitpack.encode_packed(numpy.packbits(img, axis=-1)),
+            bitpack.encode_packed(numpy.packbits(mask, axis=-1)),
+        )
+        for img, mask in zip(imgs, sheet_masks)
+    ]
+
+
+def padding_waste(sizes, sheets=None):
+    # Pixels allocated but not used, either as separate bitmaps or as sheets
+    used = sum(w * h for w, h in sizes)
+    if sheets is None:
+        return sum(bitpack.padded_width(w) * h for w, h in sizes) - used
+    return sum(w * h for w, h in sheets) - used
@@ -0,0 +1,491 @@
+import argparse
+import array
+import base64
+import io
+import json
+import math
+import os
+import time
+import timeit
+
+import numpy
+
+from one_bit import binary_library
+from one_bit import bitpack
+from one_bit import delta
+from one_bit import encode_pool
+from one_bit import level_cost
+from one_bit import library
+from one_bit import map_layout
+from one_bit import rects
+from one_bit import rle
+from one_bit import snapshot
+
+# Micro benchmarks for the exporter hot paths. These run outside of Houdini
+# on synthetic data, eg:
+#   python -m one_bit.bench encode
+
+
+ASSETS_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, "assets"
+)
+
+
+def load_library():
+    with open(os.path.join(ASSETS_DIR, "library.json")) as json_f:
+        return json.load(json_f)
+
+
+def random_voxels(resx, resy, frames=1, fill=0.3, seed=0):
+    rng = numpy.random.default_rng(seed)
+    voxels = (rng.random((frames, resy, resx)) < fill).astype(numpy.float32)
+    return [f.tobytes() for f in voxels]
+
+
+def legacy_encode_voxels(voxels, resx, resy):
+    # The original array.array based encoder, kept as a reference
+    voxel_array = array.array("f")
+    voxel_array.frombytes(voxels)
+    if resx % 32 != 0:
+        padded_xres = int(math.ceil(resx / 32)) * 32
+        padded_voxel_array = array.array("f", [0.0])
+        padded_voxel_array *= padded_xres
+        padded_voxel_array *= resy
+        for row in range(0, resy):
+            padded_voxel_array[row * padded_xres : row * padded_xres + resx] = (
+                voxel_array[row * resx : row * resx + resx]
+            )
+        voxel_array = padded_voxel_array
+
+    bitarray = numpy.packbits(numpy.array(voxel_array, dtype="bool"))
+    return str(base64.urlsafe_b64encode(bitarray), "ascii")
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def bench_encode(repeat=5):
+    cases = (
+        ("background 400x240", 400, 240, 1),
+        ("sequence 64x64x18", 64, 64, 18),
+        ("sequence 64x64x24", 64, 64, 24),
+        ("odd 37x53x12", 37, 53, 12),
+    )
+    for label, resx, resy, nframes in cases:
+        frames = random_voxels(resx, resy, nframes)
+
+        legacy = [legacy_encode_voxels(f, resx, resy) for f in frames]
+        if legacy != bitpack.encode_sequence(frames, resx, resy):
+            raise AssertionError(f"{label}: batch encoding differs from legacy")
+        if legacy != [bitpack.encode_voxels(f, resx, resy) for f in frames]:
+            raise AssertionError(f"{label}: frame encoding differs from legacy")
+
+        before = _time(
+            lambda: [legacy_encode_voxels(f, resx, resy) for f in frames], repeat
+        )
+        after = _time(lambda: bitpack.encode_sequence(frames, resx, resy), repeat)
+        print(
+            f"{label:<24} legacy {before * 1000:8.2f}ms  "
+            f"numpy {after * 1000:8.2f}ms  x{before / after:.1f}"
+        )
+
+
+def bench_encode_pool(repeat=5):
+    # A library's worth of groups, encoded serially vs across every core
+    groups = []
+    for i in range(40):
+        frames = random_voxels(64, 64, 24, seed=i)
+        groups.append([((64, 64), f, f) for f in frames])
+    for i in range(10):
+        frame = random_voxels(400, 240, 1, seed=i)[0]
+        groups.append([((400, 240), frame, None)])
+
+    serial = [bitpack.encode_frames(g) for g in groups]
+
+    def encode_all(pool):
+        futures = [pool.submit(g) for g in groups]
+        return [pool.result(f, g) for f, g in zip(futures, groups)]
+
+    before = _time(lambda: [bitpack.encode_frames(g) for g in groups], repeat)
+    print(f"{'serial':<24} {before * 1000:8.2f}ms")
+    with encode_pool.EncodePool(0) as pool:
+        if encode_all(pool) != serial:
+            raise AssertionError("pool encoding differs from serial")
+        after = _time(lambda: encode_all(pool), repeat)
+    print(
+        f"{f'pool ({pool.workers} workers)':<24} {after * 1000:8.2f}ms  "
+        f"x{before / after:.1f}"
+    )
+
+
+def bench_binary_library(repeat=5):
+    lib = load_library()
+    indented = json.dumps(lib, indent=1)
+    binary_f = io.BytesIO()
+    binary_library.write_library(lib, binary_f)
+    binary = binary_f.getvalue()
+
+    def parse_json():
+        for entry in library.iter_bitmaps(json.loads(indented)):
+            if "bitmap" in entry:
+                fields = library.bitmap_fields(entry)
+                library.decode(fields["img"])
+                if fields["img_mask"] is not None:
+                    library.decode(fields["img_mask"])
+
+    parsed = binary_library.read_library(binary)
+    records = binary_library.iter_records(library.iter_bitmaps(lib))
+    for bitmap, record in zip(parsed, records):
+        if bytes(bitmap.img or b"") != (record.img or b""):
+            raise AssertionError("binary library doesn't round trip")
+
+    json_time = _time(parse_json, repeat)
+    binary_time = _time(lambda: binary_library.read_library(binary), repeat)
+    print(
+        f"{'library.json':<24} {len(indented):8d} bytes  {json_time * 1000:8.2f}ms"
+    )
+    print(
+        f"{'library.bin':<24} {len(binary):8d} bytes  {binary_time * 1000:8.2f}ms  "
+        f"{len(binary) / len(indented):.0%} of the size"
+    )
+
+
+def delta_encode_group(bitmaps, interval):
+    # Re-encodes a group of raw library bitmaps the way the exporter does
+    keyframes = delta.KeyframeEncoder(interval)
+    encoded = []
+    for entry in bitmaps:
+        fields = library.bitmap_fields(entry)
+        width, height, has_mask = fields["spec"][:3]
+        res = (width, height)
+        img, img_mask = fields["img"], fields["img_mask"]
+        encoding = rle.ENCODING_RAW
+        deltas = keyframes.encode(res, img, img_mask, delta.encoded_size(img, img_mask))
+        keyframes.advance(res, img, img_mask)
+        if deltas is not None:
+            img, img_mask = deltas
+            encoding = rle.ENCODING_XOR_DELTA
+        encoded.append(
+            {
+                "bitmap": [
+                    {"spec": [width, height, has_mask, encoding]},
+                    {"img": img},
+                    {"img_mask": img_mask},
+                ]
+            }
+        )
+    return encoded
+
+
+def bench_delta(repeat=5):
+    # Keyframe + XOR delta encoding of the animated groups, decoded again
+    # with the reference decoder to check the round trip
+    lib = load_library()
+    for sop_path, metadata, bitmaps in library.iter_groups(lib):
+        if metadata["static"]:
+            continue
+        for interval in (4, delta.DEFAULT_KEYFRAME_INTERVAL, len(bitmaps)):
+            encoded = delta_encode_group(bitmaps, interval)
+            before = list(binary_library.iter_records(bitmaps))
+            if list(binary_library.iter_records(encoded)) != before:
+                raise AssertionError(f"{sop_path}: delta encoding doesn't round trip")
+            raw_bytes = sum(len(json.dumps(b)) for b in bitmaps)
+            delta_bytes = sum(len(json.dumps(b)) for b in encoded)
+            encode_time = _time(lambda: delta_encode_group(bitmaps, interval), repeat)
+            print(
+                f"{sop_path:<32} interval {interval:3d}  {raw_bytes:7d} -> "
+                f"{delta_bytes:7d} bytes  x{raw_bytes / delta_bytes:.1f}  "
+                f"{encode_time * 1000:6.2f}ms"
+            )
+
+
+def random_element_rows(count, seed=0):
+    # Elements multiparm rows as they come out of parmsAsData
+    rng = numpy.random.default_rng(seed)
+    return [
+        {
+            "bitmap_id#": int(rng.integers(0, 50)),
+            "position#": [int(rng.integers(0, 400)), int(rng.integers(0, 240))],
+            "depth#": int(rng.integers(-100, 100)),
+            "frame_offset#": int(rng.integers(0, 24)),
+            "flip#": bool(rng.integers(0, 2)),
+        }
+        for _ in range(count)
+    ]
+
+
+# Assumed cost of a single HOM call from a Python callback
+HOM_CALL_SECONDS = 10e-6
+
+
+class MockMultiparmNode:
+    # Stands in for a node with an elements multiparm, every HOM call is
+    # counted and busy waits for HOM_CALL_SECONDS
+    def __init__(self, rows, call_seconds=HOM_CALL_SECONDS):
+        self.rows = rows
+        self.call_seconds = call_seconds
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        end = time.perf_counter() + self.call_seconds
+        while time.perf_counter() < end:
+            pass
+
+    def eval_parm_tuple(self, index, name):
+        self._call()
+        value = self.rows[index][name]
+        return tuple(value) if isinstance(value, list) else (value,)
+
+    def parmsAsData(self, evaluate=True, brief=False):
+        self._call()
+        return {"elements": [dict(row) for row in self.rows]}
+
+
+def per_parm_rows(node, names):
+    # The per parm path of multiparms._eval_rows, one eval per parm tuple of
+    # every instance
+    rows = []
+    for index in range(len(node.rows)):
+        row = {}
+        for name in names:
+            value = node.eval_parm_tuple(index, name)
+            row[name] = value[0] if len(value) == 1 else list(value)
+        rows.append(row)
+    return rows
+
+
+def bench_parm_snapshot(repeat=5):
+    # Reading an elements multiparm into a snapshot and iterating it the way
+    # iter_elements_parms does, with an eval per parm tuple against a single
+    # parmsAsData call. The HOM calls are counted on a mock node, their cost
+    # is the assumed HOM_CALL_SECONDS.
+    names = list(snapshot.ELEMENT_COLUMNS)
+    for count in (1000, 10000):
+        node = MockMultiparmNode(random_element_rows(count))
+
+        def per_parm():
+            rows = per_parm_rows(node, names)
+            elements = snapshot.MultiparmSnapshot(rows, snapshot.ELEMENT_COLUMNS)
+            return list(elements.rows(*names))
+
+        def batched():
+            rows = node.parmsAsData(evaluate=True, brief=False)["elements"]
+            elements = snapshot.MultiparmSnapshot(rows, snapshot.ELEMENT_COLUMNS)
+            return list(elements.rows(*names))
+
+        if per_parm() != batched():
+            raise AssertionError("snapshot rows differ from the per parm rows")
+        calls = {}
+        for name, func in (("per_parm", per_parm), ("batched", batched)):
+            node.calls = 0
+            func()
+            calls[name] = node.calls
+        per_parm_time = _time(per_parm, repeat)
+        batched_time = _time(batched, repeat)
+        print(
+            f"{f'{count} elements':<24} per parm {per_parm_time * 1000:8.2f}ms "
+            f"({calls['per_parm']} calls)  parmsAsData {batched_time * 1000:8.2f}ms "
+            f"({calls['batched']} call)"
+        )
+
+
+def random_blob_masks(count, size=64, seed=0):
+    # Overlapping disks, roughly the shape of bushes and rocks
+    rng = numpy.random.default_rng(seed)
+    yy, xx = numpy.mgrid[:size, :size]
+    masks = []
+    for _ in range(count):
+        mask = numpy.zeros((size, size), dtype=bool)
+        for cx, cy, radius in rng.uniform((8, 8, 4), (size - 8, size - 8, 16), (4, 3)):
+            mask |= (xx - cx) ** 2 + (yy - cy) ** 2 < radius**2
+        masks.append(mask)
+    return masks
+
+
+def bench_mask_colliders(repeat=5):
+    # Decomposing the masks of a few hundred sprites, without reusing the
+    # rects of sprites that share a bitmap
+    masks = random_blob_masks(300)
+    for tolerance in (1, 2, 4, 8):
+
+        def decompose():
+            return [rects.mask_rects(m, tolerance) for m in masks]
+
+        covers = decompose()
+        covered = 0
+        for mask, cover in zip(masks, covers):
+            drawn = numpy.zeros_like(mask)
+            for x, y, w, h in cover:
+                drawn[y : y + h, x : x + w] = True
+            covered += (drawn == mask).mean()
+        elapsed = _time(decompose, repeat)
+        print(
+            f"{f'tolerance {tolerance}':<24} {elapsed * 1000:8.2f}ms  "
+            f"{sum(map(len, covers)) / len(masks):5.1f} rects per sprite  "
+            f"{covered / len(masks):.1%} of pixels match"
+        )
+
+
+def random_collider_rows(count, seed=0):
+    # Detail rows of the colliders multiparm, as build_colliders_geo gets them
+    rng = numpy.random.default_rng(seed)
+    return [
+        {
+            "collider_type#": int(rng.integers(0, 3)),
+            "collider_color#": rng.random(3).tolist(),
+            "collider_pos#": rng.integers(0, 400, 2).tolist(),
+            "collider_size#": rng.integers(1, 64, 2).tolist(),
+        }
+        for _ in range(count)
+    ]
+
+
+def bench_collider_preview(repeat=5):
+    # The arrays build_colliders_geo hands to hou in a handful of bulk calls,
+    # the time per collider should stay flat as the count grows. Replaces a
+    # grid and a primitive verb execution plus a merge per collider.
+    for count in (10, 100, 1000, 10000):
+        rows = random_collider_rows(count)
+
+        def outlines():
+            colliders = snapshot.MultiparmSnapshot(
+                [row for row in rows if row["collider_type#"] != 0],
+                snapshot.COLLIDER_COLUMNS,
+            )
+            points, outlines = rects.preview_outlines(
+                colliders["collider_pos#"], colliders["collider_size#"], (400, 240)
+            )
+            colors = colliders["collider_color#"].astype(numpy.float32).tobytes()
+            return points.tolist(), outlines.tolist(), colors
+
+        active = sum(row["collider_type#"] != 0 for row in rows)
+        elapsed = _time(outlines, repeat)
+        print(
+            f"{f'{count} colliders':<24} {elapsed * 1000:8.2f}ms  "
+            f"{elapsed / count * 1e6:6.2f}us per collider  "
+            f"verb executions {active * 2} -> 0, merges {active} -> 1"
+        )
+
+
+def grid_map_edges(size):
+    # A size x size grid of levels, each connected to its east and south
+    # neighbours, in shuffled order
+    edges = []
+    for y in range(size):
+        for x in range(size):
+            if x + 1 < size:
+                edges.append((f"l{x}_{y}", f"l{x + 1}_{y}", "west_of"))
+            if y + 1 < size:
+                edges.append((f"l{x}_{y}", f"l{x}_{y + 1}", "north_of"))
+    order = numpy.random.default_rng(0).permutation(len(edges))
+    return [edges[0]] + [edges[i] for i in order if i]
+
+
+def bench_map_layout(repeat=5):
+    # Laying out grid worlds, the old layout scanned every edge per visited
+    # level and stopped after 1000 visits
+    for size in (10, 32, 100):
+        edges = grid_map_edges(size)
+        result = map_layout.layout(edges)
+        if len(result.cells) != size * size or map_layout.problems(result):
+            raise AssertionError("grid map laid out wrong")
+        elapsed = _time(lambda: map_layout.layout(edges), repeat)
+        print(
+            f"{f'{size * size} levels':<24} {elapsed * 1000:8.2f}ms  "
+            f"{len(edges)} connections"
+        )
+
+
+def atlas_level(count, frames=4, size=32, seed=0):
+    # An atlas library with a static atlas slot and an animated group, and a
+    # level placing count sprites of each
+    voxels = random_voxels(size, size, frames + 1, seed=seed)
+    animated = [
+        {
+            "bitmap": [
+                {"spec": [size, size, False]},
+                {"img": bitpack.encode_voxels(frame, size, size)},
+                {"img_mask": None},
+            ]
+        }
+        for frame in voxels[1:]
+    ]
+    atlas_slot = {"atlas_slot": 0}
+    lib = {
+        "bitmap_library": [
+            {".total_sprites.": frames + 1},
+            {"/rock": [{"metadata": {"static": True}}, {"bitmaps": [atlas_slot]}]},
+            {"/bird": [{"metadata": {"static": False}}, {"bitmaps": animated}]},
+        ]
+    }
+    rng = numpy.random.default_rng(seed)
+    sprites = []
+    for index in range(count * 2):
+        x, y = rng.integers((0, 0), (400 - size, 240 - size))
+        sprite = {
+            "position": [int(x), int(y)],
+            "depth": index,
+            "flip": bool(index % 4 == 1),
+        }
+        if index % 2:
+            sprite.update(bitmap_id=1, animated=True, duration=frames)
+        else:
+            sprite.update(bitmap_id=0, animated=False, duration=1, sheet=0)
+            sprite["rect"] = [0, 0, size, size]
+        sprites.append({"sprite": sprite})
+    level = {
+        ".level_name.": "atlas",
+        "level_data": {"sprites": [{".total_sprites.": len(sprites)}, sprites]},
+    }
+    return lib, level
+
+
+def bench_level_cost(repeat=5):
+    # Cost of levels built from an atlas library, the animated sprites are
+    # decoded from the library and the atlas sprites counted as their rect
+    for count in (10, 50):
+        lib, level = atlas_level(count)
+
+        def cost():
+            return level_cost.level_cost(level, level_cost.library_bitmaps(lib))[0]
+
+        result = cost()
+        if (result["sprites"], result["animated"]) != (count * 2, count):
+            raise AssertionError(f"wrong level cost {result}")
+        elapsed = _time(cost, repeat)
+        print(
+            f"{f'{count * 2} sprites':<24} {elapsed * 1000:8.2f}ms  "
+            f"overdraw {result['overdraw']:.2f}"
+        )
+
+
+BENCHMARKS = {
+    "encode": bench_encode,
+    "encode_pool": bench_encode_pool,
+    "binary_library": bench_binary_library,
+    "delta": bench_delta,
+    "parm_snapshot": bench_parm_snapshot,
+    "mask_colliders": bench_mask_colliders,
+    "collider_preview": bench_collider_preview,
+    "map_layout": bench_map_layout,
+    "level_cost": bench_level_cost,
+}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="one_bit exporter benchmarks")
+    parser.add_argument("benchmarks", nargs="*", metavar="|".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(args)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name](repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import collections
+import struct
+
+from one_bit import bitpack
+from one_bit import delta
+from one_bit import library
+from one_bit import masks
+from one_bit import rle
+
+# Compact binary container for the bitmap library, an alternative to the
+# base64 library.json. Everything is little endian and every block is a
+# multiple of 4 bytes, so the bits can be copied straight into the buffers
+# from getBitmapData.
+#
+# header:
+#   char[4] magic "1BIT"
+#   u16     version
+#   u16     flags (reserved)
+#   u32     bitmap count
+# per bitmap, in flat bitmap_id order:
+#   u16     width
+#   u16     height
+#   u16     rowbytes
+#   u8      flags (FLAG_MASK | FLAG_REF)
+#   u8      reserved
+#   if FLAG_REF:
+#     u32   bitmap_id this is a duplicate of
+#   else:
+#     u8[rowbytes * height] img
+#     u8[rowbytes * height] mask (only with FLAG_MASK)
+
+MAGIC = b"1BIT"
+VERSION = 1
+
+FLAG_MASK = 1 << 0
+FLAG_REF = 1 << 1
+
+HEADER = struct.Struct("<4sHHI")
+RECORD = struct.Struct("<HHHBB")
+REF = struct.Struct("<I")
+
+Bitmap = collections.namedtuple(
+    "Bitmap", ["width", "height", "rowbytes", "img", "mask", "ref"]
+)
+
+
+class LibraryFormatError(ValueError):
+    pass
+
+
+def _decode_block(encoded, res, encoding, base):
+    if encoding == rle.ENCODING_XOR_DELTA:
+        return delta.apply_delta(base, encoded, res)
+    return rle.decode_bitmap(encoded, res, encoding)
+
+
+def iter_records(bitmaps, dims=None):
+    # Converts exported bitmap entries (in flat order) to Bitmap tuples. dims
+    # collects the (width, height, rowbytes, img, mask) per bitmap_id to
+    # resolve refs and deltas, pass the same dict in when converting a
+    # library a group at a time. Deltas are written out as full bitmaps.
+    dims = {} if dims is None else dims
+    for entry in bitmaps:
+        bitmap_id = len(dims)
+        if "atlas_slot" in entry:
+            raise LibraryFormatError("Atlas libraries can't be written as binary")
+        if "bitmap_ref" in entry:
+            ref = entry["bitmap_ref"]
+            width, height, rowbytes = dims[ref][:3]
+            bitmap = Bitmap(width, height, rowbytes, None, None, ref)
+            dims[bitmap_id] = dims[ref]
+            yield bitmap
+            continue
+
+        fields = library.bitmap_fields(entry)
+        width, height, has_mask = fields["spec"][:3]
+        encoding = library.spec_encoding(fields["spec"])
+        prev_img = prev_mask = None
+        if encoding == rle.ENCODING_XOR_DELTA:
+            if not bitmap_id or dims[bitmap_id - 1][:2] != (width, height):
+                raise LibraryFormatError(f"Bitmap {bitmap_id} has no delta base")
+            prev_img, prev_mask = dims[bitmap_id - 1][3:]
+            if has_mask and fields["img_mask"] is not None and prev_mask is None:
+                raise LibraryFormatError(f"Bitmap {bitmap_id} has no mask delta base")
+
+        img = _decode_block(fields["img"], (width, height), encoding, prev_img)
+        mask = None
+        if library.spec_mask_mode(fields["spec"]) == masks.MASK_IMAGE:
+            mask = img
+        elif has_mask:
+            mask = _decode_block(
+                fields["img_mask"], (width, height), encoding, prev_mask
+            )
+        bitmap = Bitmap(width, height, bitpack.row_bytes(width), img, mask, None)
+        dims[bitmap_id] = tuple(bitmap[:5])
+        yield bitmap
+
+
+class BinaryLibraryWriter:
+    # Writes bitmaps as they are exported, the bitmap count in the header is
+    # filled in when the writer is closed (so binary_f has to be seekable).
+    def __init__(self, binary_f):
+        self.binary_f = binary_f
+        self.dims = {}
+        self.header_pos = binary_f.tell()
+        binary_f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+    def add_bitmaps(self, bitmaps):
+        for bitmap in iter_records(bitmaps, self.dims):
+            self.write_record(bitmap)
+
+    def write_record(self, bitmap):
+        flags = 0
+        if bitmap.ref is not None:
+            flags |= FLAG_REF
+        elif bitmap.mask is not None:
+            flags |= FLAG_MASK
+        self.binary_f.write(
+            RECORD.pack(bitmap.width, bitmap.height, bitmap.rowbytes, flags, 0)
+        )
+        if bitmap.ref is not None:
+            self.binary_f.write(REF.pack(bitmap.ref))
+            return
+        self.binary_f.write(bitmap.img)
+        if bitmap.mask is not None:
+            self.binary_f.write(bitmap.mask)
+
+    def close(self):
+        end = self.binary_f.tell()
+        self.binary_f.seek(self.header_pos)
+        self.binary_f.write(HEADER.pack(MAGIC, VERSION, 0, len(self.dims)))
+        self.binary_f.seek(end)
+        return len(self.dims)
+
+
+def write_library(lib, binary_f):
+    with BinaryLibraryWriter(binary_f) as writer:
+        writer.add_bitmaps(library.iter_bitmaps(lib))
+    return len(writer.dims)
+
+
+def read_library(data):
+    # Parses and validates a binary library, returns a list of Bitmap.
+    # Data blocks are memoryviews into data, nothing is copied.
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise LibraryFormatError("Truncated header")
+    magic, version, _, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise LibraryFormatError(f"Bad magic {magic!r}")
+    if version != VERSION:
+        raise LibraryFormatError(f"Unsupported version {version}")
+
+    bitmaps = []
+    offset = HEADER.size
+    for bitmap_id in range(count):
+        if offset + RECORD.size > len(data):
+            raise LibraryFormatError(f"Truncated record for bitmap {bitmap_id}")
+        width, height, rowbytes, flags, _ = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if rowbytes != bitpack.row_bytes(width):
+            raise LibraryFormatError(
+                f"Bitmap {bitmap_id} rowbytes {rowbytes} doesn't match width {width}"
+            )
+
+        if flags & FLAG_REF:
+            if offset + REF.size > len(data):
+                raise LibraryFormatError(f"Truncated ref for bitmap {bitmap_id}")
+            (ref,) = REF.unpack_from(data, offset)
+            offset += REF.size
+            if ref >= bitmap_id or bitmaps[ref].ref is not None:
+                raise LibraryFormatError(f"Bitmap {bitmap_id} has invalid ref {ref}")
+            bitmaps.append(Bitmap(width, height, rowbytes, None, None, ref))
+            continue
+
+        size = rowbytes * height
+        blocks = 2 if flags & FLAG_MASK else 1
+        if offset + size * blocks > len(data):
+            raise LibraryFormatError(f"Truncated data for bitmap {bitmap_id}")
+        img = data[offset : offset + size]
+        offset += size
+        mask = None
+        if flags & FLAG_MASK:
+            mask = data[offset : offset + size]
+            offset += size
+        bitmaps.append(Bitmap(width, height, rowbytes, img, mask, None))
+
+    if offset != len(data):
+        raise LibraryFormatError(f"{len(data) - offset} trailing bytes")
+    return bitmaps
+
+
+def binary_path_for(export_path):
+    root = export_path[:-5] if export_path.endswith(".json") else export_path
+    return root + ".bin"
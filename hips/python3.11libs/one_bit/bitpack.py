@@ -0,0 +1,87 @@
+import base64
+import itertools
+import math
+
+import numpy
+
+# The Playdate internally stores bitmaps as an array of ints
+# So in a given row there will always be some multiple of 4 bytes of data
+# (aka rowbytes). To make things easier / faster when streaming levels into
+# the Playdate we pad the bitmaps here, at the cost of some extra space.
+#
+# Nothing in here depends on hou, the functions work on the raw bytes from
+# hou.Volume.allVoxelsAsString() so they can be used outside of Houdini
+# (and in worker processes).
+
+ROW_ALIGN = 32
+
+
+def padded_width(resx):
+    return int(math.ceil(resx / ROW_ALIGN)) * ROW_ALIGN
+
+
+def row_bytes(resx):
+    return padded_width(resx) // 8
+
+
+def voxels_to_bits(voxels, resx, resy):
+    # voxels is either a single frame or a concatenation of frames, any
+    # non-zero voxel is treated as "on" (matches numpy's bool cast)
+    if isinstance(voxels, numpy.ndarray):
+        values = voxels.reshape(-1)
+    else:
+        values = numpy.frombuffer(voxels, dtype=numpy.float32)
+    frames = values.size // (resx * resy)
+    if frames * resx * resy != values.size:
+        raise ValueError(
+            f"{values.size} voxels is not a multiple of a {resx}x{resy} bitmap"
+        )
+    values = values.reshape(frames, resy, resx)
+
+    padded_x = padded_width(resx)
+    if padded_x == resx:
+        return values != 0
+
+    bits = numpy.zeros((frames, resy, padded_x), dtype=bool)
+    numpy.not_equal(values, 0, out=bits[:, :, :resx])
+    return bits
+
+
+def pack_voxels(voxels, resx, resy):
+    # Returns a (frames, resy, rowbytes) uint8 array
+    return numpy.packbits(voxels_to_bits(voxels, resx, resy), axis=-1)
+
+
+def encode_packed(packed):
+    return str(base64.urlsafe_b64encode(numpy.ascontiguousarray(packed)), "ascii")
+
+
+def encode_voxels(voxels, resx, resy):
+    return encode_packed(pack_voxels(voxels, resx, resy))
+
+
+def encode_sequence(frames, resx, resy):
+    # Pack an entire animated sequence as a single 3D batch, one encoded
+    # string per frame.
+    if not frames:
+        return []
+    packed = pack_voxels(b"".join(frames), resx, resy)
+    return [encode_packed(frame) for frame in packed]
+
+
+def encode_frames(frames):
+    # frames is a list of (res, img_voxels, mask_voxels | None) as raw voxel
+    # bytes. Consecutive frames sharing a resolution (ie, every frame of an
+    # animated sequence) get packed together as one batch.
+    encoded = []
+    for (res, has_mask), group in itertools.groupby(
+        frames, key=lambda f: (f[0], f[2] is not None)
+    ):
+        group = list(group)
+        imgs = encode_sequence([f[1] for f in group], *res)
+        if has_mask:
+            masks = encode_sequence([f[2] for f in group], *res)
+        else:
+            masks = [None] * len(group)
+        encoded.extend(zip(imgs, masks))
+    return encoded
@@ -0,0 +1,93 @@
+import base64
+
+import numpy
+
+from one_bit import bitpack
+from one_bit import rle
+
+# Keyframe + XOR delta encoding of animated bitmap groups.
+#
+# Consecutive frames of a sequence usually only differ by a few pixels, so
+# between keyframes a frame is stored as the XOR against the previous bitmap
+# (in flat bitmap_id order), PackBits compressed per row. The unchanged rows
+# XOR to runs of 0x00 which collapse to 2 bytes per 128 bytes of row.
+#
+# A delta's base is whatever the previous bitmap decoded to, which is also
+# true when it's a bitmap_ref, and the mask delta is against the previous
+# mask (the img for MASK_IMAGE bitmaps). A delta is only possible when the
+# previous bitmap has the same res and, if this one has a mask, a mask.
+#
+# Deltas use rle.ENCODING_XOR_DELTA in the spec, keyframes are stored raw or
+# with PackBits as any other bitmap.
+
+DEFAULT_KEYFRAME_INTERVAL = 8
+
+
+def _packed(encoded, res):
+    data = base64.urlsafe_b64decode(encoded)
+    return numpy.frombuffer(data, numpy.uint8).reshape(res[1], -1)
+
+
+def encode_delta(res, prev, img, img_mask):
+    # prev is the (res, img, mask) of the previous bitmap as raw encoded
+    # strings, mask being None when it's unmasked. Returns the (img, img_mask)
+    # deltas or None when this frame can't be stored as a delta.
+    prev_res, prev_img, prev_mask = prev
+    if tuple(prev_res) != tuple(res):
+        return None
+    if img_mask is not None and prev_mask is None:
+        return None
+    deltas = []
+    for encoded, base in ((img, prev_img), (img_mask, prev_mask)):
+        if encoded is None:
+            deltas.append(None)
+            continue
+        rows = rle.packbits_rows(_packed(encoded, res) ^ _packed(base, res))
+        deltas.append(str(base64.urlsafe_b64encode(rows), "ascii"))
+    return deltas[0], deltas[1]
+
+
+def apply_delta(base, delta, res):
+    # base is the raw padded rows of the previous bitmap, delta the base64
+    # data from the library. Returns the raw padded rows of this bitmap.
+    rowbytes = bitpack.row_bytes(res[0])
+    xor = rle.unpackbits_rows(base64.urlsafe_b64decode(delta), rowbytes, res[1])
+    if len(base) != len(xor):
+        raise ValueError(f"Delta base is {len(base)} bytes, expected {len(xor)}")
+    return (
+        numpy.frombuffer(base, numpy.uint8) ^ numpy.frombuffer(xor, numpy.uint8)
+    ).tobytes()
+
+
+def encoded_size(img, img_mask):
+    return len(img) + len(img_mask or "")
+
+
+class KeyframeEncoder:
+    # Picks keyframes and deltas for the frames of a single group, fed in
+    # flat order. A keyframe is forced every interval frames, otherwise a
+    # delta is used whenever it's possible and smaller than the keyframe.
+    def __init__(self, interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.interval = interval
+        self.prev = None
+        self.since_keyframe = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    def advance(self, res, img, mask):
+        # Records the (raw) bits the frame decodes to, mask is None when the
+        # frame is drawn unmasked
+        self.prev = (res, img, mask)
+        self.since_keyframe += 1
+
+    def encode(self, res, img, img_mask, keyframe_size):
+        # Returns the (img, img_mask) deltas, or None for a keyframe
+        deltas = None
+        if self.prev is not None and self.since_keyframe < self.interval:
+            deltas = encode_delta(res, self.prev, img, img_mask)
+        if deltas is not None and encoded_size(*deltas) < keyframe_size:
+            self.deltas += 1
+            return deltas
+        self.keyframes += 1
+        self.since_keyframe = 0
+        return None
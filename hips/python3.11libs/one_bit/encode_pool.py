@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from one_bit import bitpack
+
+# Only cooking the volumes needs hou, padding / packing / base64 encoding
+# the raw voxel bytes can happen in other processes. The main thread keeps
+# cooking and submitting while the workers encode, results are always
+# collected in submission order so the export stays deterministic.
+#
+# Inside of Houdini sys.executable is Houdini itself, so the workers are
+# spawned with a plain Python interpreter instead. Either set
+# ONE_BIT_WORKER_PYTHON or we'll look for the one that ships in $HFS.
+
+
+def worker_python():
+    python = os.environ.get("ONE_BIT_WORKER_PYTHON")
+    if python:
+        return python
+    hfs = os.environ.get("HFS")
+    if hfs:
+        version = f"{sys.version_info.major}{sys.version_info.minor}"
+        for candidate in (
+            os.path.join(hfs, "python", "bin", "python3"),
+            os.path.join(hfs, f"python{version}", "python.exe"),
+            os.path.join(hfs, "Frameworks", "Python.framework", "Versions",
+                         "Current", "bin", "python3"),
+        ):
+            if os.path.isfile(candidate):
+                return candidate
+    return sys.executable
+
+
+def completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class EncodePool:
+    # workers <= 0 uses every core, 1 encodes serially in this process.
+    def __init__(self, workers=1):
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.executor = None
+        if workers > 1:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(worker_python())
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def submit(self, frames):
+        # frames is a list of (res, img_voxels, mask_voxels | None), returns a
+        # Future of the bitpack.encode_frames result
+        if self.executor is None:
+            return completed(bitpack.encode_frames(frames))
+        try:
+            return self.executor.submit(bitpack.encode_frames, frames)
+        except BrokenProcessPool:
+            return self.fallback(frames)
+
+    def result(self, future, frames):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            return self.fallback(frames).result()
+
+    def fallback(self, frames):
+        # Workers couldn't be started (or died), finish the export serially
+        if self.executor is not None:
+            print("Encode pool unavailable, encoding serially")
+            self.shutdown()
+        return completed(bitpack.encode_frames(frames))
@@ -0,0 +1,114 @@
+import hashlib
+import json
+
+from one_bit import json_stream
+
+# On disk cache of encoded bitmaps, so re-exporting the library only
+# re-encodes the bitmaps whose voxels actually changed.
+#
+# Entries are keyed by "sop_path@frame" and validated against a fingerprint
+# of the raw voxel data. Every export bumps the generation counter, entries
+# touched in that export get the current generation and when the cache grows
+# past max_bytes the least recently used generations are evicted first.
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_path_for(export_path):
+    return export_path + ".cache"
+
+
+def voxel_fingerprint(res, img_voxels, mask_voxels):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{res[0]}x{res[1]}:".encode("ascii"))
+    digest.update(img_voxels)
+    if mask_voxels is not None:
+        digest.update(b"mask:")
+        digest.update(mask_voxels)
+    return digest.hexdigest()
+
+
+def entry_size(entry):
+    return len(entry["img"]) + len(entry["img_mask"] or "")
+
+
+class ExportCache:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, force=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if not force:
+            self.load()
+        self.generation += 1
+
+    @staticmethod
+    def key(sop_path, frame):
+        return f"{sop_path}@{frame}"
+
+    def load(self):
+        try:
+            with open(self.path, "r") as cache_f:
+                data = json.load(cache_f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        self.generation = data.get("generation", 0)
+        self.entries = data.get("entries", {})
+
+    def get(self, key, fingerprint):
+        entry = self.entries.get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["generation"] = self.generation
+        return entry["img"], entry["img_mask"]
+
+    def put(self, key, fingerprint, img, img_mask):
+        self.entries[key] = {
+            "fingerprint": fingerprint,
+            "img": img,
+            "img_mask": img_mask,
+            "generation": self.generation,
+        }
+
+    def size(self):
+        return sum(entry_size(e) for e in self.entries.values())
+
+    def evict(self):
+        total = self.size()
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["generation"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry_size(self.entries.pop(key))
+            evicted += 1
+        return evicted
+
+    def save(self):
+        evicted = self.evict()
+        with json_stream.atomic_open(self.path, "w") as cache_f:
+            json.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "generation": self.generation,
+                    "entries": self.entries,
+                },
+                cache_f,
+            )
+        return evicted
+
+    def report(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size(),
+        }
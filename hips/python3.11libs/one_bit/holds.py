@@ -0,0 +1,31 @@
+# Collapsing of held frames in animated bitmap groups.
+#
+# Animations often hold a pose for a few frames, which exports the same
+# bitmap again and again. Runs of identical consecutive frames are stored
+# once along with how many ticks they are shown for, so the group only has
+# its unique frames and the Playdate doesn't swap images on every tick.
+#
+# Frames are compared on their raw voxels, so this works on the output of
+# trim.trim_frames as well. Holds are a u8 on the Playdate side, longer runs
+# are split.
+
+MAX_HOLD = 255
+
+
+def collapse_frames(frames):
+    # frames is a list of (frame, res, img_voxels, mask_voxels) for a single
+    # bitmap group. Returns the unique frames and the number of ticks each
+    # one is held for.
+    unique = []
+    holds = []
+    for frame in frames:
+        if unique and holds[-1] < MAX_HOLD and frame[1:] == unique[-1][1:]:
+            holds[-1] += 1
+            continue
+        unique.append(frame)
+        holds.append(1)
+    return unique, holds
+
+
+def is_held(holds):
+    return any(hold > 1 for hold in holds)
@@ -0,0 +1,111 @@
+import contextlib
+import json
+import os
+
+# Streaming JSON writer for the exporters.
+#
+# dump() writes dicts / lists like json.dump (with the same output for the
+# same indent) but any other iterable, such as a generator, is written as an
+# array one item at a time as it is produced. That way an exporter can hand
+# over its groups lazily and never hold the whole export in memory.
+#
+# Counts like ".total_sprites." have to come before the arrays they count
+# (the Playdate allocates when it sees them) but aren't known until the
+# generators are exhausted. A Deferred value reserves some whitespace in the
+# file, which is patched in with the final value once everything is written.
+
+DEFERRED_WIDTH = 20
+
+
+class Deferred:
+    def __init__(self, value=None):
+        self.value = value
+
+    def set(self, value):
+        self.value = value
+
+
+class JsonStreamWriter:
+    def __init__(self, stream, indent=None):
+        # stream must be a seekable binary file when Deferred values are used
+        self.stream = stream
+        self.indent = indent
+        self.key_separator = ":" if indent is None else ": "
+        self.deferred = []
+
+    def write(self, text):
+        self.stream.write(text.encode("ascii"))
+
+    def newline(self, depth):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * depth)
+
+    def dump(self, obj):
+        self.write_value(obj, 0)
+        self.patch_deferred()
+
+    def write_value(self, obj, depth):
+        if isinstance(obj, Deferred):
+            self.deferred.append((self.stream.tell(), obj))
+            self.write(" " * DEFERRED_WIDTH)
+        elif obj is None or isinstance(obj, (str, int, float, bool)):
+            self.write(json.dumps(obj))
+        elif isinstance(obj, dict):
+            self.write_items(obj.items(), "{", "}", depth, keyed=True)
+        else:
+            self.write_items(obj, "[", "]", depth, keyed=False)
+
+    def write_items(self, items, open_char, close_char, depth, keyed):
+        empty = True
+        for item in items:
+            if empty:
+                self.write(open_char)
+                empty = False
+            else:
+                self.write(",")
+            self.write(self.newline(depth + 1))
+            if keyed:
+                key, item = item
+                self.write(json.dumps(key) + self.key_separator)
+            self.write_value(item, depth + 1)
+
+        if empty:
+            self.write(open_char + close_char)
+        else:
+            self.write(self.newline(depth) + close_char)
+
+    def patch_deferred(self):
+        end = self.stream.tell()
+        for position, deferred in self.deferred:
+            text = json.dumps(deferred.value)
+            if len(text) > DEFERRED_WIDTH:
+                raise ValueError(f"Deferred value {text} is too wide")
+            self.stream.seek(position)
+            self.write(text)
+        self.stream.seek(end)
+        self.deferred = []
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="wb"):
+    # Write to a temp file next to path and only replace path once the
+    # writing succeeded, a failed export never leaves a half written file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as tmp_f:
+            yield tmp_f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dump(obj, stream, indent=None):
+    JsonStreamWriter(stream, indent=indent).dump(obj)
+
+
+def dump_file(obj, path, indent=None):
+    with atomic_open(path) as json_f:
+        dump(obj, json_f, indent=indent)
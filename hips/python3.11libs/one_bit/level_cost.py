@@ -0,0 +1,304 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+import numpy
+
+from one_bit import binary_library
+from one_bit import bitpack
+from one_bit import library
+from one_bit import raster
+
+# Redraw / overdraw cost of exported levels, from the level json written by
+# level_builder.build_level and the bitmap library. Doesn't need hou:
+#
+#   python -m one_bit.level_cost ../../assets/library.json \
+#       ../../assets/levels/*.json --json cost.json --heatmaps heatmaps
+#
+# Per level:
+#   sprite_pixels  opaque pixels drawn on screen, summed over every sprite
+#   overdraw       sprite_pixels / covered pixels, 1.0 is no overdraw
+#   max_depth      most sprites covering a single pixel
+#   dirty_mean     screen pixels marked dirty per tick by animated sprites
+#   dirty_peak     (swapping their image), averaged and at the worst tick
+#   sprites, animated, colliders
+#   background     1 when the static sprites were baked into a background,
+#                  drawn as one more sprite but not counted in sprites
+#
+# The heatmap is the number of sprites covering every pixel, written as a
+# PGM (no extra dependencies) scaled so max_depth is white. Levels over any
+# of the budgets (--budget-<name> to override them) are flagged and make
+# the command exit with 1.
+
+BUDGETS = {
+    "overdraw": 2.0,
+    "max_depth": 6,
+    # Fraction of the screen
+    "dirty_mean": 0.25,
+    "dirty_peak": 0.5,
+    "sprites": 64,
+    "colliders": 64,
+}
+
+# Ticks simulated to find the dirty area, covers a full loop of most levels
+MAX_TICKS = 240
+
+FIELDS = [
+    "level",
+    "sprites",
+    "background",
+    "animated",
+    "colliders",
+    "sprite_pixels",
+    "covered_pixels",
+    "overdraw",
+    "max_depth",
+    "dirty_mean",
+    "dirty_peak",
+    "flags",
+]
+
+
+def packed_as_drawn(data, width, height, rowbytes, flip=False):
+    # Raw padded rows from the library (bottom row first) to a bool array as
+    # drawn, see raster.voxels_as_drawn
+    rows = numpy.frombuffer(data, numpy.uint8).reshape(height, rowbytes)
+    bits = numpy.unpackbits(rows, axis=-1)[:, :width][::-1]
+    if flip:
+        bits = bits[:, ::-1]
+    return bits != 0
+
+
+def library_bitmaps(lib):
+    # Returns bitmap(bitmap_id, flip), the (img, mask) as drawn of every
+    # bitmap in the library, decoded on first use
+    records = []
+    dims = {}
+    for entry in library.iter_bitmaps(lib):
+        if "atlas_slot" in entry:
+            # Packed into an atlas sheet, the sprites carry their rect instead.
+            # Refs and deltas never point at atlas slots.
+            dims[len(dims)] = None
+            records.append(None)
+            continue
+        records.extend(binary_library.iter_records([entry], dims))
+    cache = {}
+
+    def bitmap(bitmap_id, flip):
+        if (bitmap_id, flip) not in cache:
+            record = records[bitmap_id]
+            if record.ref is not None:
+                record = records[record.ref]
+            img = packed_as_drawn(record.img, *record[:3], flip)
+            mask = None
+            if record.mask is not None:
+                mask = packed_as_drawn(record.mask, *record[:3], flip)
+            cache[bitmap_id, flip] = (img, mask)
+        return cache[bitmap_id, flip]
+
+    return bitmap
+
+
+def iter_level_items(level, name):
+    # Yields the tables of the "sprite" / "collider" entries of a level
+    _, items = level["level_data"].get(f"{name}s", [{}, []])
+    for item in items:
+        yield item[name]
+
+
+def sprite_placements(level, bitmap):
+    # raster.Placement per sprite, along with its holds
+    placements = []
+    for index, sprite in enumerate(iter_level_items(level, "sprite")):
+        x, y = sprite["position"]
+        duration = sprite["duration"] if sprite["animated"] else 1
+        if "rect" in sprite:
+            # Atlas sprite, counted as an opaque rect
+            _, _, w, h = sprite["rect"]
+            frames = [(numpy.ones((h, w), dtype=bool), None)] * duration
+        else:
+            frames = [
+                bitmap(sprite["bitmap_id"] + i, sprite["flip"])
+                for i in range(duration)
+            ]
+        placements.append(
+            (
+                raster.Placement(
+                    index, x, y, sprite["depth"], sprite["animated"], frames
+                ),
+                sprite.get("frame_offset", 0),
+                sprite.get("holds", []),
+            )
+        )
+    background = level["level_data"].get("background")
+    if background is not None:
+        # Baked static sprites, a single masked bitmap
+        res = (background["resx"], background["resy"])
+        rowbytes = bitpack.row_bytes(res[0])
+        img = packed_as_drawn(library.decode(background["img"]), *res, rowbytes)
+        mask = None
+        if background.get("has_mask"):
+            mask = packed_as_drawn(
+                library.decode(background["img_mask"]), *res, rowbytes
+            )
+        x, y = background["position"]
+        placements.append(
+            (
+                raster.Placement(
+                    -1, x, y, background["depth"], False, [(img, mask)]
+                ),
+                0,
+                [],
+            )
+        )
+    return placements
+
+
+def swap_ticks(duration, frame_offset, holds, ticks):
+    # bool per tick, True when the sprite swaps its image on that tick (see
+    # LoopingSprite.loopAnimation)
+    if not holds:
+        return numpy.ones(ticks, dtype=bool)
+    # Ticks into the loop at which every frame ends
+    ends = numpy.cumsum(holds)
+    total = int(ends[-1])
+    start = int(ends[frame_offset % duration] - holds[frame_offset % duration])
+    elapsed = (start + numpy.arange(1, ticks + 1)) % total
+    return numpy.isin(elapsed, ends % total)
+
+
+def loop_ticks(animated):
+    # Length of a loop of every animated sprite, capped to MAX_TICKS
+    ticks = 1
+    for placement, _, holds in animated:
+        loop = sum(holds) if holds else len(placement.frames)
+        ticks = min(math.lcm(ticks, loop), MAX_TICKS)
+    return ticks
+
+
+def level_cost(
+    level, bitmap, width=raster.SCREEN_WIDTH, height=raster.SCREEN_HEIGHT
+):
+    # Returns the cost dict of a level (see above) and its heatmap
+    placements = sprite_placements(level, bitmap)
+    heatmap = numpy.zeros((height, width), dtype=numpy.int32)
+    animated = []
+    for placement, frame_offset, holds in placements:
+        cover = raster.union_mask(placement)
+        slices = raster.screen_slices(placement, cover.shape, width, height)
+        if slices is None:
+            continue
+        screen, local = slices
+        heatmap[screen] += cover[local]
+        if placement.animated:
+            animated.append((placement, frame_offset, holds))
+
+    ticks = loop_ticks(animated)
+    dirty = numpy.zeros((ticks, height, width), dtype=bool)
+    for placement, frame_offset, holds in animated:
+        # The whole bounds of a sprite are redrawn when its image changes
+        shape = placement.frames[0][0].shape
+        screen, _ = raster.screen_slices(placement, shape, width, height)
+        swaps = swap_ticks(len(placement.frames), frame_offset, holds, ticks)
+        dirty[(swaps,) + screen] = True
+    dirty_area = dirty.reshape(ticks, -1).sum(axis=1)
+
+    sprite_pixels = int(heatmap.sum())
+    covered_pixels = int(numpy.count_nonzero(heatmap))
+    # The background is placed with index -1
+    background = sum(placement.index < 0 for placement, _, _ in placements)
+    return {
+        "level": level[".level_name."],
+        "sprites": len(placements) - background,
+        "background": background,
+        "animated": sum(placement.animated for placement, _, _ in placements),
+        "colliders": sum(1 for _ in iter_level_items(level, "collider")),
+        "sprite_pixels": sprite_pixels,
+        "covered_pixels": covered_pixels,
+        "overdraw": sprite_pixels / covered_pixels if covered_pixels else 0.0,
+        "max_depth": int(heatmap.max()),
+        "dirty_mean": float(dirty_area.mean()) / (width * height),
+        "dirty_peak": float(dirty_area.max()) / (width * height),
+    }, heatmap
+
+
+def over_budget(cost, budgets=BUDGETS):
+    return [name for name, budget in budgets.items() if cost[name] > budget]
+
+
+def write_heatmap(heatmap, path):
+    # Binary PGM, 0 is no sprite and white the most overdrawn pixel
+    scale = 255 / max(int(heatmap.max()), 1)
+    pixels = (heatmap * scale).astype(numpy.uint8)
+    with open(path, "wb") as pgm_f:
+        pgm_f.write(f"P5 {pixels.shape[1]} {pixels.shape[0]} 255\n".encode())
+        pgm_f.write(pixels.tobytes())
+
+
+def write_csv(costs, path):
+    with open(path, "w", newline="") as csv_f:
+        writer = csv.DictWriter(csv_f, FIELDS)
+        writer.writeheader()
+        for cost in costs:
+            writer.writerow({**cost, "flags": " ".join(cost["flags"])})
+
+
+def print_costs(costs):
+    print(
+        f"{'level':<24}{'sprites':>8}{'bg':>4}{'anim':>6}{'colls':>6}"
+        f"{'overdraw':>10}{'depth':>7}{'dirty':>8}{'peak':>8}"
+    )
+    for cost in costs:
+        flags = f"  OVER: {', '.join(cost['flags'])}" if cost["flags"] else ""
+        print(
+            f"{cost['level']:<24}{cost['sprites']:>8}{cost['background']:>4}"
+            f"{cost['animated']:>6}"
+            f"{cost['colliders']:>6}{cost['overdraw']:>10.2f}{cost['max_depth']:>7}"
+            f"{cost['dirty_mean']:>8.1%}{cost['dirty_peak']:>8.1%}{flags}"
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Level redraw / overdraw cost")
+    parser.add_argument("library", help="library.json the levels were built with")
+    parser.add_argument("levels", nargs="+", help="exported level json files")
+    parser.add_argument("--json", help="write the report as json")
+    parser.add_argument("--csv", help="write the report as csv")
+    parser.add_argument("--heatmaps", help="directory to write <level>.pgm to")
+    for name, budget in BUDGETS.items():
+        parser.add_argument(
+            f"--budget-{name.replace('_', '-')}",
+            dest=f"budget_{name}",
+            type=type(budget),
+            default=budget,
+        )
+    args = parser.parse_args(args)
+    budgets = {name: getattr(args, f"budget_{name}") for name in BUDGETS}
+
+    with open(args.library) as lib_f:
+        bitmap = library_bitmaps(json.load(lib_f))
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+    costs = []
+    for level_path in args.levels:
+        with open(level_path) as level_f:
+            cost, heatmap = level_cost(json.load(level_f), bitmap)
+        cost["flags"] = over_budget(cost, budgets)
+        costs.append(cost)
+        if args.heatmaps:
+            write_heatmap(heatmap, os.path.join(args.heatmaps, f"{cost['level']}.pgm"))
+
+    print_costs(costs)
+    if args.json:
+        with open(args.json, "w") as json_f:
+            json.dump(costs, json_f, indent=1)
+    if args.csv:
+        write_csv(costs, args.csv)
+    return 1 if any(cost["flags"] for cost in costs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# Helpers for walking an exported bitmap library, ie the dict returned by
+# bitmap_library.build_library or a loaded library.json.
+#
+# {"bitmap_library" : [
+#   {".total_sprites." : int},
+#   {sop_path : [
+#     {"metadata" : {"static" : bool, "start_frame" : int, "end_frame" : int,
+#                    ("keyframe_interval" : int),
+#                    ("frame_holds" : [int, ...])}},
+#     {"bitmaps" : [
+#       {"bitmap" : [
+#         {"spec" : [resx, resy, has_mask, (encoding), (mask_mode)]},
+#         {"img" : str},
+#         {"img_mask" : str | null},
+#       ]},
+#       {"bitmap_ref" : int},
+#       {"atlas_slot" : int},
+#       ...
+#     ]},
+#   ]},
+#   ...
+#   {".atlas." : [
+#     {"sheets" : [{"bitmap" : [...]}, ...]},
+#     {"rects" : [[sheet, x, y, w, h], ...]},
+#   ]},
+# ]}
+
+import base64
+
+
+def iter_group_entry(entry):
+    # Yields (sop_path, metadata, bitmaps) for a single bitmap_library entry
+    for key, value in entry.items():
+        if key.startswith("."):
+            continue
+        metadata = {}
+        bitmaps = []
+        for item in value:
+            metadata.update(item.get("metadata", {}))
+            bitmaps = item.get("bitmaps", bitmaps)
+        yield key, metadata, bitmaps
+
+
+def iter_groups(library):
+    # Yields (sop_path, metadata, bitmaps) per bitmap group
+    for entry in library["bitmap_library"]:
+        yield from iter_group_entry(entry)
+
+
+def iter_bitmaps(library):
+    # Yields every bitmap entry in flat (Playdate bitmap_id) order
+    for _, _, bitmaps in iter_groups(library):
+        yield from bitmaps
+
+
+def bitmap_fields(bitmap):
+    # Flattens a {"bitmap" : [...]} entry into a single dict
+    fields = {}
+    for item in bitmap["bitmap"]:
+        fields.update(item)
+    return fields
+
+
+def decode(encoded):
+    return base64.urlsafe_b64decode(encoded)
+
+
+def spec_encoding(spec):
+    # The optional 4th spec entry is the rle encoding, see one_bit.rle
+    return spec[3] if len(spec) > 3 else 0
+
+
+def spec_mask_mode(spec):
+    # The optional 5th spec entry, see one_bit.masks
+    return spec[4] if len(spec) > 4 else 0
+
+
+def total_bitmaps(library):
+    return library["bitmap_library"][0][".total_sprites."]
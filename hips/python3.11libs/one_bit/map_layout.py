@@ -0,0 +1,83 @@
+import collections
+import hashlib
+import json
+
+# Grid layout of the levels of a map from their connections.
+#
+# Connections are (a, b, direction) edges, direction being "west_of" (b is
+# one cell east of a) or "north_of" (b is one cell below a), see
+# map_builder.layout_map. The levels are placed with a breadth first walk
+# over an adjacency list, every level is placed once from the first edge
+# that reaches it, so it scales with the number of connections.
+#
+# The other edges are only checked: an edge putting a level somewhere else
+# than where it was placed is an inconsistent cycle, and levels ending up in
+# the same cell collide. Levels not reachable from the start are unplaced.
+
+STEPS = {
+    "west_of": (1, 0),
+    "north_of": (0, -1),
+}
+
+Layout = collections.namedtuple(
+    "Layout", ["cells", "collisions", "inconsistent", "unplaced"]
+)
+
+
+def adjacency(edges):
+    # {level : [(other, dx, dy), ...]} in both directions
+    neighbours = collections.defaultdict(list)
+    for a, b, direction in edges:
+        dx, dy = STEPS[direction]
+        neighbours[a].append((b, dx, dy))
+        neighbours[b].append((a, -dx, -dy))
+    return neighbours
+
+
+def layout(edges, start=None):
+    # Returns a Layout, cells being {level : (x, y)} with y up and start at
+    # (0, 0), start defaults to the first level of the first edge
+    neighbours = adjacency(edges)
+    if not neighbours:
+        return Layout({}, [], [], [])
+    start = edges[0][0] if start is None else start
+    cells = {start: (0, 0)}
+    queue = collections.deque([start])
+    inconsistent = {}
+    while queue:
+        level = queue.popleft()
+        x, y = cells[level]
+        for other, dx, dy in neighbours[level]:
+            cell = (x + dx, y + dy)
+            if other not in cells:
+                cells[other] = cell
+                queue.append(other)
+            elif cells[other] != cell:
+                # Seen from both ends, keep one
+                inconsistent.setdefault(frozenset((level, other)), (level, other))
+
+    occupants = collections.defaultdict(list)
+    for level, cell in cells.items():
+        occupants[cell].append(level)
+    collisions = [levels for levels in occupants.values() if len(levels) > 1]
+    unplaced = [level for level in neighbours if level not in cells]
+    return Layout(cells, collisions, list(inconsistent.values()), unplaced)
+
+
+def connections_key(edges, start=None):
+    # Hash of everything the layout depends on
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([start, list(map(list, edges))]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def problems(result):
+    # Human readable list of what's wrong with a Layout
+    messages = []
+    for levels in result.collisions:
+        messages.append(f"{', '.join(levels)} overlap")
+    for a, b in result.inconsistent:
+        messages.append(f"{a} and {b} connections don't line up")
+    if result.unplaced:
+        messages.append(f"{', '.join(result.unplaced)} not connected")
+    return messages
@@ -0,0 +1,33 @@
+import base64
+
+import numpy
+
+# Classification of bitmap masks so redundant ones don't have to be stored.
+#
+#   MASK_GENERAL  the mask is stored as usual
+#   MASK_OPAQUE   every pixel is opaque, which draws exactly the same as a
+#                 bitmap without a mask so it's exported as unmasked
+#   MASK_IMAGE    the mask is identical to the image, img_mask is null and
+#                 the Playdate copies the img bits into the mask
+
+MASK_GENERAL = 0
+MASK_OPAQUE = 1
+MASK_IMAGE = 2
+
+
+def is_opaque(res, encoded):
+    packed = numpy.frombuffer(base64.urlsafe_b64decode(encoded), numpy.uint8)
+    bits = numpy.unpackbits(packed.reshape(res[1], -1), axis=-1, count=res[0])
+    return bool(bits.all())
+
+
+def classify_mask(res, img, img_mask):
+    # img / img_mask are the (raw, not rle) encoded strings. The padding bits
+    # are always 0 so equal strings mean equal masks.
+    if img_mask is None:
+        return MASK_GENERAL
+    if is_opaque(res, img_mask):
+        return MASK_OPAQUE
+    if img_mask == img:
+        return MASK_IMAGE
+    return MASK_GENERAL
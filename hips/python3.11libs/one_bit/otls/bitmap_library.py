@@ -1,77 +1,126 @@
-import base64
-import json
-import array
+import collections
+import contextlib
+import hashlib
 import itertools
-
-import numpy
-import math
+import os
 
 import hou
 
-ignored_parm_templates = (
-    hou.ButtonParmTemplate,
-    hou.FolderParmTemplate,
-    hou.FolderSetParmTemplate,
-    hou.LabelParmTemplate,
-    hou.SeparatorParmTemplate,
-)
-
-
-def multiparm_iter(parm):
-    parms = parm.multiParmInstances()
-    num = parm.multiParmInstancesPerItem()
-    for i in range(0, len(parms), num):
-        yield [
-            p
-            for p in parms[i : i + num]
-            if not isinstance(p.parmTemplate(), ignored_parm_templates)
-        ]
+from one_bit import atlas
+from one_bit import binary_library
+from one_bit import bitpack
+from one_bit import delta
+from one_bit import encode_pool
+from one_bit import export_cache
+from one_bit import holds
+from one_bit import json_stream
+from one_bit import library
+from one_bit import masks
+from one_bit import parms
+from one_bit import rle
+from one_bit import snapshot
+from one_bit import trim
+from one_bit.otls import multiparms
 
 
 def encode_volume(vol):
-    res = vol.resolution()
-
-    voxel_array = array.array("f")
-    voxel_array.frombytes(vol.allVoxelsAsString())
-
-    # The Playdate internally stores bitmaps as an array of ints
-    # So in a given row there will always be some multiple of 4 bytes of data
-    # (aka rowbytes). To make things easier / faster when streaming levels into
-    # the Playdate we'll pad the bitmaps here, at the cost of some extra space
-    if res[0] % 32 != 0:
-        padded_xres = int(math.ceil(res[0] / 32)) * 32
-        padded_voxel_array = array.array(
-            "f",
-            [
-                0.0,
-            ],
-        )
-        padded_voxel_array *= padded_xres
-        padded_voxel_array *= res[1]
-        for row in range(0, res[1]):
-            padded_voxel_array[row * padded_xres : row * padded_xres + res[0]] = (
-                voxel_array[row * res[0] : row * res[0] + res[0]]
+    resx, resy = [int(x) for x in vol.resolution()[:2]]
+    return bitpack.encode_voxels(vol.allVoxelsAsString(), resx, resy)
+
+
+def group_frames(sop, mask, static, start_frame, end_frame, frame=None):
+    # The raw voxels of every frame in a bitmap group as a list of
+    # (frame, res, img_voxels, mask_voxels | None)
+    frame_list = [frame]
+    if not static:
+        frame_list = list(range(start_frame, end_frame + 1))
+
+    frames = []
+    for bitmap_frame in frame_list:
+        try:
+            img_vol, mask_vol, res = get_img_mask_prims(
+                sop, get_mask=mask, frame=bitmap_frame
+            )
+        except VolumeError:
+            continue
+        mask_voxels = None
+        if mask_vol is not None:
+            mask_voxels = mask_vol.allVoxelsAsString()
+        frames.append((bitmap_frame, res, img_vol.allVoxelsAsString(), mask_voxels))
+    return frames
+
+
+def export_frames(
+    sop,
+    mask,
+    static,
+    start_frame,
+    end_frame,
+    frame=None,
+    trim_borders=False,
+    collapse_holds=False,
+):
+    # The frames of a bitmap group as they get exported, shared with
+    # library_to_pts so the level builder agrees with the library. Returns
+    # (frames, trimmed, frame_holds), trimmed is the (origin, canvas) or None
+    # and frame_holds the ticks per frame or None when nothing is held.
+    frames = group_frames(sop, mask, static, start_frame, end_frame, frame)
+    trimmed = None
+    if trim_borders:
+        frames, trimmed = trim.trim_frames(frames)
+    frame_holds = None
+    if collapse_holds and not static:
+        unique, group_holds = holds.collapse_frames(frames)
+        if holds.is_held(group_holds):
+            frames, frame_holds = unique, group_holds
+    return frames, trimmed, frame_holds
+
+
+def submit_frames(sop_path, frames, pool, cache=None):
+    # frames is a list of (frame, res, img_voxels, mask_voxels | None). Frames
+    # found in the cache with a matching voxel fingerprint are reused, the rest
+    # are handed to the encode pool. Returns a callable that waits for the
+    # pool and gives back the (img, img_mask) strings in frame order.
+    encoded = [None] * len(frames)
+    misses = []
+    for i, (frame, res, img_voxels, mask_voxels) in enumerate(frames):
+        key = fingerprint = None
+        if cache is not None:
+            key = cache.key(sop_path, frame)
+            fingerprint = export_cache.voxel_fingerprint(
+                res, img_voxels, mask_voxels
             )
-        voxel_array = padded_voxel_array
+            encoded[i] = cache.get(key, fingerprint)
+        if encoded[i] is None:
+            misses.append((i, key, fingerprint))
 
-    bitarray = numpy.packbits(numpy.array(voxel_array, dtype="bool"))
-    return str(base64.urlsafe_b64encode(bitarray), "ascii")
+    miss_frames = [frames[i][1:] for i, _, _ in misses]
+    future = pool.submit(miss_frames) if misses else None
 
+    def resolve():
+        if future is None:
+            return encoded
+        fresh = pool.result(future, miss_frames)
+        for (i, key, fingerprint), (img, img_mask) in zip(misses, fresh):
+            if cache is not None:
+                cache.put(key, fingerprint, img, img_mask)
+            encoded[i] = (img, img_mask)
+        return encoded
 
-def iter_bitmap_parms(node):
-    bitmap_parm = node.parm("bitmaps")
-    bitmaps = bitmap_parm.eval()
-    parm_groups = multiparm_iter(bitmap_parm)
+    return resolve
 
-    for bitmap in parm_groups:
 
-        sop, mask, static, start_frame, end_frame = bitmap
-        sop = sop.evalAsNode()
-        mask = bool(mask.eval())
-        static = bool(static.eval())
+def iter_bitmap_parms(node):
+    bitmaps = multiparms.snapshot_multiparm(
+        node, "bitmaps", snapshot.BITMAP_COLUMNS
+    )
+
+    for sop_path, mask, static, frame_range in bitmaps.rows(
+        "soppath#", "mask#", "static#", "framerange#"
+    ):
+        sop = node.node(sop_path) if sop_path else None
         if not static:
-            start_frame = start_frame.eval()
-            end_frame = end_frame.eval()
+            start_frame, end_frame = frame_range
         else:
             start_frame = None
             end_frame = None
@@ -113,69 +162,447 @@ def get_img_mask_prims(node, get_mask=True, frame=None):
     return img_vol, mask_vol, (resx, resy)
 
 
-def build_library(node, frame=None):
+def bitmap_digest(res, has_mask, img, img_mask):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{res[0]}x{res[1]}:{has_mask}:".encode("ascii"))
+    digest.update(img.encode("ascii"))
+    if img_mask is not None:
+        digest.update(img_mask.encode("ascii"))
+    return digest.digest()
+
+
+class BitmapDedupe:
+    # Content addressed lookup of already exported bitmaps. Repeated bitmaps
+    # are exported as {"bitmap_ref" : bitmap_id}, where bitmap_id is the flat
+    # (Playdate side) id of the first occurrence. This way every flat id still
+    # exists and the bitmap_offsets in level_builder.build_level don't change,
+    # the Playdate just shares the LCDBitmap instead of allocating a new one.
+    def __init__(self):
+        self.bitmap_ids = {}
+        self.bitmaps_saved = 0
+        self.bytes_saved = 0
+
+    def find(self, bitmap_id, res, has_mask, img, img_mask):
+        digest = bitmap_digest(res, has_mask, img, img_mask)
+        first_id = self.bitmap_ids.setdefault(digest, bitmap_id)
+        if first_id == bitmap_id:
+            return None
+        self.bitmaps_saved += 1
+        self.bytes_saved += len(img) + (len(img_mask) if img_mask is not None else 0)
+        return first_id
+
+    def report(self):
+        return {
+            "unique_bitmaps": len(self.bitmap_ids),
+            "bitmaps_saved": self.bitmaps_saved,
+            "bytes_saved": self.bytes_saved,
+        }
 
-    export_bitmaps = []
 
+def iter_library_groups(
+    node,
+    frame=None,
+    dedupe=False,
+    compress=False,
+    trim_borders=False,
+    elide_masks=False,
+    atlas_size=0,
+    atlas_max_bitmap=atlas.DEFAULT_MAX_BITMAP,
+    keyframe_interval=0,
+    collapse_holds=False,
+    cache=None,
+    workers=1,
+    report=None,
+):
+    # Yields the {sop_path : [metadata, bitmaps]} groups of the library in
+    # order, as they are encoded. The totals are added to report once the
+    # generator is exhausted.
+
+    deduper = BitmapDedupe() if dedupe else None
+    compression = {"compressed": 0, "raw_bytes": 0, "bytes": 0}
+    trim_report = {"trimmed": 0, "canvas_pixels": 0, "pixels": 0}
+    mask_report = {"opaque": 0, "image": 0, "general": 0, "bytes_dropped": 0}
+    # Small static bitmaps packed into atlas sheets (atlas_size > 0), they are
+    # (res, img, img_mask) in atlas slot order
+    atlas_items = []
+    atlas_report = {"bitmaps": 0, "sheets": 0, "waste_before": 0, "waste_after": 0}
+    # Per animated group keyframe / delta counts and sizes (keyframe_interval
+    # > 0), keyframe_bytes being what the frames take without deltas
+    delta_report = {}
+    holds_report = {"groups": 0, "frames_dropped": 0}
     total_bitmaps = 0
-    for sop, mask, static, start_frame, end_frame in iter_bitmap_parms(node):
 
-        bitmap_group_imgs = []
-        bitmap_group = {
-            sop.path(): [
-                {
-                    "metadata": {
-                        "static": static,
-                        "start_frame": start_frame,
-                        "end_frame": end_frame,
-                    }
-                },
-                {"bitmaps": bitmap_group_imgs},
-            ]
-        }
+    # Groups are cooked and submitted ahead of being assembled so the encode
+    # pool is kept busy, bounded so only a few groups of raw voxels are in
+    # flight at a time.
+    pending = collections.deque()
 
-        export_bitmaps.append(bitmap_group)
-
-        frame_list = [frame]
-        if not static:
-            frame_list = list(range(start_frame, end_frame + 1))
-
-        for frame in frame_list:
-            try:
-                img_vol, mask_vol, res = get_img_mask_prims(
-                    sop, get_mask=mask, frame=frame
-                )
-            except VolumeError:
+    def finish_group(sop_path, metadata, specs, resolve):
+        nonlocal total_bitmaps
+        bitmap_group_imgs = []
+        keyframes = None
+        if keyframe_interval and not metadata["static"]:
+            keyframes = delta.KeyframeEncoder(keyframe_interval)
+            group_delta = delta_report[sop_path] = {
+                "keyframes": 0,
+                "deltas": 0,
+                "keyframe_bytes": 0,
+                "bytes": 0,
+            }
+        for (res, has_mask), (img, img_mask) in zip(specs, resolve()):
+            if atlas_size and atlas.is_candidate(
+                metadata["static"], res, atlas_max_bitmap
+            ):
+                # The flat id is kept as a placeholder for the atlas rect
+                bitmap_group_imgs.append({"atlas_slot": len(atlas_items)})
+                atlas_items.append((res, img, img_mask))
+                total_bitmaps += 1
                 continue
 
-            img_mask = {"img_mask": None}
-            has_mask = mask_vol is not None
+            mask_mode = masks.MASK_GENERAL
+            if elide_masks and has_mask:
+                mask_mode = masks.classify_mask(res, img, img_mask)
+                if mask_mode != masks.MASK_GENERAL:
+                    mask_report["bytes_dropped"] += len(img_mask)
+                    img_mask = None
+                    has_mask = mask_mode != masks.MASK_OPAQUE
+                mask_report[
+                    {
+                        masks.MASK_GENERAL: "general",
+                        masks.MASK_OPAQUE: "opaque",
+                        masks.MASK_IMAGE: "image",
+                    }[mask_mode]
+                ] += 1
+
+            # The bits this frame decodes to, as the base of the next delta
+            delta_base = (res, img, img if mask_mode == masks.MASK_IMAGE else img_mask)
+
+            ref_id = None
+            if deduper is not None:
+                ref_id = deduper.find(total_bitmaps, res, has_mask, img, img_mask)
+            if ref_id is not None:
+                bitmap_group_imgs.append({"bitmap_ref": ref_id})
+                total_bitmaps += 1
+                if keyframes is not None:
+                    keyframes.advance(*delta_base)
+                continue
 
-            if has_mask:
-                img_mask["img_mask"] = encode_volume(mask_vol)
+            # Optional trailing spec entries, [.., encoding, mask_mode]
+            spec = [res[0], res[1], has_mask]
+            encoding = rle.ENCODING_RAW
+            raw = (img, img_mask)
+            if compress:
+                raw_bytes = len(img) + len(img_mask or "")
+                img, img_mask, encoding = rle.compress_bitmap(res, img, img_mask)
+                compression["compressed"] += encoding != rle.ENCODING_RAW
+                compression["raw_bytes"] += raw_bytes
+                compression["bytes"] += len(img) + len(img_mask or "")
+            if keyframes is not None:
+                keyframe_size = delta.encoded_size(img, img_mask)
+                deltas = keyframes.encode(res, *raw, keyframe_size)
+                if deltas is not None:
+                    img, img_mask = deltas
+                    encoding = rle.ENCODING_XOR_DELTA
+                keyframes.advance(*delta_base)
+                group_delta["keyframe_bytes"] += keyframe_size
+                group_delta["bytes"] += delta.encoded_size(img, img_mask)
+            if compress or elide_masks or keyframes is not None:
+                spec.append(encoding)
+            if elide_masks:
+                spec.append(mask_mode)
 
             bitmap_obj = {
                 "bitmap": [
-                    {"spec": [res[0], res[1], has_mask]},
-                    {"img": encode_volume(img_vol)},
-                    img_mask,
+                    {"spec": spec},
+                    {"img": img},
+                    {"img_mask": img_mask},
                 ]
             }
 
             bitmap_group_imgs.append(bitmap_obj)
             total_bitmaps += 1
 
-    export_bitmaps.insert(0, {".total_sprites." :total_bitmaps})
+        if keyframes is not None:
+            group_delta["keyframes"] = keyframes.keyframes
+            group_delta["deltas"] = keyframes.deltas
+        return {sop_path: [{"metadata": metadata}, {"bitmaps": bitmap_group_imgs}]}
+
+    with encode_pool.EncodePool(workers) as pool:
+        max_pending = pool.workers * 2
+        for sop, mask, static, start_frame, end_frame in iter_bitmap_parms(node):
+
+            metadata = {
+                "static": static,
+                "start_frame": start_frame,
+                "end_frame": end_frame,
+            }
+            if keyframe_interval and not static:
+                metadata["keyframe_interval"] = keyframe_interval
+
+            frames, trimmed, frame_holds = export_frames(
+                sop,
+                mask,
+                static,
+                start_frame,
+                end_frame,
+                frame,
+                trim_borders=trim_borders,
+                collapse_holds=collapse_holds,
+            )
+            if trimmed is not None:
+                origin, canvas = trimmed
+                metadata["origin"] = origin
+                metadata["canvas"] = canvas
+                resx, resy = frames[0][1]
+                trim_report["trimmed"] += 1
+                trim_report["canvas_pixels"] += len(frames) * canvas[0] * canvas[1]
+                trim_report["pixels"] += len(frames) * resx * resy
+            if frame_holds is not None:
+                # Ticks each exported frame is shown for
+                metadata["frame_holds"] = frame_holds
+                holds_report["groups"] += 1
+                holds_report["frames_dropped"] += sum(frame_holds) - len(frames)
+
+            resolve = submit_frames(sop.path(), frames, pool, cache=cache)
+            specs = [(f[1], f[3] is not None) for f in frames]
+            pending.append((sop.path(), metadata, specs, resolve))
+            while len(pending) > max_pending:
+                yield finish_group(*pending.popleft())
+
+        while pending:
+            yield finish_group(*pending.popleft())
+
+    if atlas_items:
+        sizes = [item[0] for item in atlas_items]
+        rects, sheets = atlas.pack(sizes, atlas_size)
+        sheet_bitmaps = [
+            {
+                "bitmap": [
+                    {"spec": [w, h, True]},
+                    {"img": img},
+                    {"img_mask": img_mask},
+                ]
+            }
+            for (w, h), (img, img_mask) in zip(
+                sheets, atlas.build_sheets(atlas_items, rects, sheets)
+            )
+        ]
+        yield {".atlas.": [{"sheets": sheet_bitmaps}, {"rects": rects}]}
+        atlas_report["bitmaps"] = len(atlas_items)
+        atlas_report["sheets"] = len(sheets)
+        atlas_report["waste_before"] = atlas.padding_waste(sizes)
+        atlas_report["waste_after"] = atlas.padding_waste(sizes, sheets)
+
+    if report is not None:
+        report["total_bitmaps"] = total_bitmaps
+        if deduper is not None:
+            report["dedupe"] = deduper.report()
+        if cache is not None:
+            report["cache"] = cache.report()
+        if compress:
+            report["compression"] = compression
+        if trim_borders:
+            report["trim"] = trim_report
+        if elide_masks:
+            report["masks"] = mask_report
+        if atlas_size:
+            report["atlas"] = atlas_report
+        if keyframe_interval:
+            report["delta"] = delta_report
+        if collapse_holds:
+            report["holds"] = holds_report
+
+
+def build_library(node, frame=None, report=None, **kwargs):
+    report = {} if report is None else report
+    export_bitmaps = list(
+        iter_library_groups(node, frame=frame, report=report, **kwargs)
+    )
+    export_bitmaps.insert(0, {".total_sprites." :report["total_bitmaps"]})
     return {"bitmap_library": export_bitmaps}
 
 
+def stream_library(node, report, binary_writer=None, **kwargs):
+    # Lazy version of build_library for json_stream, the groups are only
+    # encoded as they get written out.
+    total_bitmaps = json_stream.Deferred()
+
+    def groups():
+        for group in iter_library_groups(node, report=report, **kwargs):
+            if binary_writer is not None:
+                for _, _, bitmaps in library.iter_group_entry(group):
+                    binary_writer.add_bitmaps(bitmaps)
+            yield group
+        total_bitmaps.set(report["total_bitmaps"])
+
+    return {
+        "bitmap_library": itertools.chain(
+            [{".total_sprites.": total_bitmaps}], groups()
+        )
+    }
+
+
+def print_report(report):
+    print(f"Exported {report['total_bitmaps']} bitmaps")
+    if "dedupe" in report:
+        dedupe = report["dedupe"]
+        print(
+            f"  dedupe: {dedupe['unique_bitmaps']} unique, "
+            f"{dedupe['bitmaps_saved']} bitmaps saved, "
+            f"{dedupe['bytes_saved']} bytes saved"
+        )
+    if "compression" in report:
+        compression = report["compression"]
+        print(
+            f"  rle: {compression['compressed']} bitmaps compressed, "
+            f"{compression['raw_bytes']} -> {compression['bytes']} bytes"
+        )
+    if "trim" in report:
+        trimmed = report["trim"]
+        print(
+            f"  trim: {trimmed['trimmed']} groups trimmed, "
+            f"{trimmed['canvas_pixels']} -> {trimmed['pixels']} pixels"
+        )
+    if "masks" in report:
+        mask_report = report["masks"]
+        print(
+            f"  masks: {mask_report['opaque']} opaque and {mask_report['image']} "
+            f"same as image dropped, {mask_report['general']} kept, "
+            f"{mask_report['bytes_dropped']} bytes dropped"
+        )
+    if "atlas" in report:
+        atlas_report = report["atlas"]
+        print(
+            f"  atlas: {atlas_report['bitmaps']} bitmaps in "
+            f"{atlas_report['sheets']} sheets, padding waste "
+            f"{atlas_report['waste_before']} -> {atlas_report['waste_after']} pixels"
+        )
+    if "holds" in report:
+        holds_report = report["holds"]
+        print(
+            f"  holds: {holds_report['groups']} groups with held frames, "
+            f"{holds_report['frames_dropped']} frames dropped"
+        )
+    if "delta" in report:
+        for sop_path, group_delta in report["delta"].items():
+            ratio = group_delta["keyframe_bytes"] / max(group_delta["bytes"], 1)
+            print(
+                f"  delta {sop_path}: {group_delta['keyframes']} keyframes + "
+                f"{group_delta['deltas']} deltas, {group_delta['keyframe_bytes']} "
+                f"-> {group_delta['bytes']} bytes (x{ratio:.1f})"
+            )
+    if "cache" in report:
+        cache = report["cache"]
+        print(
+            f"  cache: {cache['hits']} hits, {cache['misses']} re-encoded, "
+            f"{cache['entries']} entries ({cache['bytes']} bytes)"
+        )
+
+
+def atlas_size(node):
+    # 0 when atlas packing is disabled
+    if not parms.parm_value(node, "atlas", False):
+        return 0
+    return int(parms.parm_value(node, "atlas_size", atlas.DEFAULT_SHEET_SIZE))
+
+
+def atlas_max_bitmap(node):
+    return int(parms.parm_value(node, "atlas_max_bitmap", atlas.DEFAULT_MAX_BITMAP))
+
+
+def keyframe_interval(node):
+    # 0 when delta encoding is disabled
+    if not parms.parm_value(node, "delta_frames", False):
+        return 0
+    return int(
+        parms.parm_value(node, "keyframe_interval", delta.DEFAULT_KEYFRAME_INTERVAL)
+    )
+
+
+# Opt-in modes BitmapLibParser (src/BitmapLib.zig) can't decode yet, it
+# reads their entries as raw bitmaps and ends up at the wrong bitmap ids
+RUNTIME_UNSUPPORTED = {
+    "compress_rows": "Compress Rows",
+    # atlas_slot entries, and the sprites would need to draw their rect
+    "atlas": "Atlas",
+    # XOR deltas against the previous frame
+    "delta_frames": "Delta Frames",
+}
+
+
+def runtime_unsupported(node):
+    # Labels of the enabled modes the Playdate runtime can't load
+    return [
+        label
+        for name, label in RUNTIME_UNSUPPORTED.items()
+        if parms.parm_value(node, name, False)
+    ]
+
+
+def targets_runtime(path):
+    # The Playdate build copies assets/ into the pdx and embeds
+    # src/library.json
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    return "assets" in parts[:-1] or parts[-2:] == ["src", "library.json"]
+
+
+def check_runtime_modes(node, path):
+    unsupported = runtime_unsupported(node)
+    if not unsupported:
+        return
+    modes = ", ".join(unsupported)
+    if targets_runtime(path):
+        raise hou.NodeError(
+            f"The Playdate runtime can't load libraries exported with {modes} "
+            "yet, turn them off or export outside of the game assets"
+        )
+    print(f"Warning: the Playdate runtime can't load this library ({modes})")
+
+
 def export_callback(node):
     path = node.parm("export_path").eval()
     if not path:
         return
-    image_export = build_library(node)
-    with open(path, "w") as json_f:
-        json.dump(image_export, json_f, indent=1)
+    check_runtime_modes(node, path)
+    report = {}
+    cache = None
+    if parms.parm_value(node, "use_cache", True):
+        cache = export_cache.ExportCache(
+            export_cache.cache_path_for(path),
+            max_bytes=int(
+                parms.parm_value(node, "cache_size_mb", 64) * 1024 * 1024
+            ),
+            force=bool(parms.parm_value(node, "force_rebuild", False)),
+        )
+    indent = parms.json_indent(node)
+    with contextlib.ExitStack() as stack:
+        binary_writer = None
+        if parms.parm_value(node, "export_binary", False):
+            binary_f = stack.enter_context(
+                json_stream.atomic_open(binary_library.binary_path_for(path))
+            )
+            binary_writer = stack.enter_context(
+                binary_library.BinaryLibraryWriter(binary_f)
+            )
+        image_export = stream_library(
+            node,
+            report,
+            binary_writer=binary_writer,
+            dedupe=bool(parms.parm_value(node, "dedupe", True)),
+            compress=bool(parms.parm_value(node, "compress_rows", False)),
+            trim_borders=bool(parms.parm_value(node, "trim", False)),
+            elide_masks=bool(parms.parm_value(node, "elide_masks", True)),
+            atlas_size=atlas_size(node),
+            atlas_max_bitmap=atlas_max_bitmap(node),
+            keyframe_interval=keyframe_interval(node),
+            collapse_holds=bool(parms.parm_value(node, "collapse_holds", False)),
+            cache=cache,
+            workers=int(parms.parm_value(node, "encode_workers", 1)),
+        )
+        json_stream.dump_file(image_export, path, indent=indent)
+    if cache is not None:
+        cache.save()
+    print_report(report)
 
 
 def library_to_detail(hda_node, node, frame=None):
@@ -213,10 +640,34 @@ def library_to_pts(hda_node, node, frame=None):
     bitmap_id_atr = geo.addAttrib(
         hou.attribType.Point, "bitmap_id", -1, create_local_variable=False
     )
+    # Where the trimmed bitmap sits within the res canvas (see one_bit.trim)
+    trim_origin_atr = geo.addAttrib(
+        hou.attribType.Point, "trim_origin", [0, 0], create_local_variable=False
+    )
+    trim_res_atr = geo.addAttrib(
+        hou.attribType.Point, "trim_res", [0, 0], create_local_variable=False
+    )
+    trim_borders = bool(parms.parm_value(hda_node, "trim", False))
+    # Ticks per exported frame when held frames are collapsed (see
+    # one_bit.holds), empty when every frame is shown for one tick
+    holds_atr = geo.addArrayAttrib(
+        hou.attribType.Point, "frame_holds", hou.attribData.Int
+    )
+    collapse_holds = bool(parms.parm_value(hda_node, "collapse_holds", False))
+    # Where the bitmap ended up in the atlas sheets (see one_bit.atlas)
+    atlas_sheet_atr = geo.addAttrib(
+        hou.attribType.Point, "atlas_sheet", -1, create_local_variable=False
+    )
+    atlas_rect_atr = geo.addAttrib(
+        hou.attribType.Point, "atlas_rect", [0, 0, 0, 0], create_local_variable=False
+    )
+    sheet_size = atlas_size(hda_node)
+    max_bitmap = atlas_max_bitmap(hda_node)
+    atlas_pts = []
 
 
-    for i, parms in enumerate(iter_bitmap_parms(hda_node)):
-        sop, mask, static, start_frame, end_frame = parms
+    for i, bitmap_parms in enumerate(iter_bitmap_parms(hda_node)):
+        sop, mask, static, start_frame, end_frame = bitmap_parms
         try:
             img_vol, mask_vol, res = get_img_mask_prims(sop, get_mask=mask, frame=frame)
         except VolumeError:
@@ -232,3 +683,30 @@ def library_to_pts(hda_node, node, frame=None):
 
         pt.setAttribValue(res_atr, res)
         pt.setAttribValue(mask_atr, mask_vol is not None)
+
+        trim_res = res
+        if (trim_borders and mask_vol is not None) or (collapse_holds and not static):
+            frames, trimmed, frame_holds = export_frames(
+                sop,
+                mask,
+                static,
+                start_frame,
+                end_frame,
+                frame,
+                trim_borders=trim_borders,
+                collapse_holds=collapse_holds,
+            )
+            if trimmed is not None:
+                pt.setAttribValue(trim_origin_atr, trimmed[0])
+                trim_res = frames[0][1]
+            if frame_holds is not None:
+                pt.setAttribValue(holds_atr, frame_holds)
+        pt.setAttribValue(trim_res_atr, trim_res)
+        if sheet_size and atlas.is_candidate(static, trim_res, max_bitmap):
+            atlas_pts.append((pt, tuple(trim_res)))
+
+    if atlas_pts:
+        rects, _ = atlas.pack([size for _, size in atlas_pts], sheet_size)
+        for (pt, _), rect in zip(atlas_pts, rects):
+            pt.setAttribValue(atlas_sheet_atr, rect[0])
+            pt.setAttribValue(atlas_rect_atr, rect[1:])
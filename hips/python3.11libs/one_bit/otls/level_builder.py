@@ -1,79 +1,231 @@
-import json
 import random
-import itertools
 
 import hou
+import numpy
 
-ignored_parm_templates = (
-    hou.ButtonParmTemplate,
-    hou.FolderParmTemplate,
-    hou.FolderSetParmTemplate,
-    hou.LabelParmTemplate,
-    hou.SeparatorParmTemplate,
-)
-
-
-def multiparm_iter(parm):
-    parms = parm.multiParmInstances()
-    num = parm.multiParmInstancesPerItem()
-    for i in range(0, len(parms), num):
-        yield [
-            p
-            for p in parms[i : i + num]
-            if not isinstance(p.parmTemplate(), ignored_parm_templates)
-        ]
+from one_bit import json_stream
+from one_bit import parms
+from one_bit import raster
+from one_bit import rects
+from one_bit import snapshot
+from one_bit import trim
+from one_bit.otls import bitmap_library
+from one_bit.otls import multiparms
 
 
 def iter_elements_parms(node):
-    elements_parm = node.parm("elements")
-    num_elements = elements_parm.eval()
-    parm_groups = multiparm_iter(elements_parm)
-
-    for element in parm_groups:
-        bitmap_id, pos_x, pos_y, depth, foffset, flip = element
-        bitmap_id = bitmap_id.evalAsInt()
-        pos_x = pos_x.evalAsInt()
-        pos_y = pos_y.evalAsInt()
-        depth = depth.evalAsInt()
-        foffset = foffset.evalAsInt()
-        flip = bool(flip.eval())
+    elements = multiparms.snapshot_multiparm(
+        node, "elements", snapshot.ELEMENT_COLUMNS
+    )
+    for bitmap_id, (pos_x, pos_y), depth, foffset, flip in elements.rows(
+        "bitmap_id#", "position#", "depth#", "frame_offset#", "flip#"
+    ):
         yield (bitmap_id, pos_x, pos_y, depth, foffset, flip)
 
-def iter_colliders_parms(node):
-    colliders_parm = node.parm("colliders")
-    num_colliders= colliders_parm.eval()
-    parm_groups = multiparm_iter(colliders_parm)
 
-    for collider in parm_groups:
-        ctype, r, g, b, xpos, ypos, resx, resy = collider
-        ctype = ctype.evalAsInt()
+def iter_colliders_parms(node):
+    colliders = multiparms.snapshot_multiparm(
+        node, "colliders", snapshot.COLLIDER_COLUMNS
+    )
+    for ctype, (xpos, ypos), (resx, resy) in colliders.rows(
+        "collider_type#", "collider_pos#", "collider_size#"
+    ):
         if ctype == 0:
             continue
-        xpos = xpos.evalAsInt()
-        ypos = ypos.evalAsInt()
-        resx = resx.evalAsInt()
-        resy = resy.evalAsInt()
-        yield (ctype, xpos, ypos, resx, resy )
+        yield (ctype, xpos, ypos, resx, resy)
+
+
+# ctype of generated colliders, the first collider type after "none"
+CTYPE_BLOCKER = 1
+
+
+def mask_collider_ids(node):
+    # Elements (library bitmap_ids) to generate colliders for, ie "3 7 12"
+    bitmap_ids = set()
+    for token in str(parms.parm_value(node, "mask_colliders", "")).split():
+        try:
+            bitmap_ids.add(int(token))
+        except ValueError:
+            raise hou.NodeError(
+                f"Mask Colliders: {token!r} isn't a bitmap id, expected ids "
+                "separated by spaces"
+            ) from None
+    return bitmap_ids
+
+
+def element_mask(mask_vol, flip):
+    # The mask as drawn, rows top down and mirrored when flipped
+    resx, resy = mask_vol.resolution()[:2]
+    voxels = numpy.frombuffer(mask_vol.allVoxelsAsString(), dtype=numpy.float32)
+    mask = voxels.reshape(resy, resx)[::-1]
+    if flip:
+        mask = mask[:, ::-1]
+    return mask != 0
+
+
+def generate_mask_colliders(
+    node, bitmap_ids, tolerance=1, max_rects=rects.DEFAULT_MAX_RECTS
+):
+    # Blocker colliders covering the masks of the elements placed from
+    # bitmap_ids, as (ctype, x, y, w, h). Each bitmap / flip pair is only
+    # decomposed once and moved to the position of every element using it.
+    mask_prims = node.node("mask").geometry().prims()
+    shapes = {}
+    colliders = []
+    for bitmap_id, pos_x, pos_y, _, _, flip in iter_elements_parms(node):
+        if bitmap_id not in bitmap_ids:
+            continue
+        if (bitmap_id, flip) not in shapes:
+            shapes[bitmap_id, flip] = rects.mask_rects(
+                element_mask(mask_prims[bitmap_id], flip), tolerance, max_rects
+            )
+        colliders.extend(
+            (CTYPE_BLOCKER, pos_x + x, pos_y + y, w, h)
+            for x, y, w, h in shapes[bitmap_id, flip]
+        )
+    return colliders
+
+
+def library_frames(library_geo):
+    # Returns frames(bitmap_id, flip), the raster frames of a library bitmap
+    # (see one_bit.raster), cooked from its SOP once per bitmap / flip
+    points = {pt.attribValue("bitmap_id"): pt for pt in library_geo.points()}
+    cache = {}
+
+    def frames(bitmap_id, flip):
+        if (bitmap_id, flip) not in cache:
+            pt = points[bitmap_id]
+            group = bitmap_library.group_frames(
+                hou.node(pt.attribValue("bitmap")),
+                bool(pt.attribValue("has_mask")),
+                bool(pt.attribValue("static")),
+                pt.attribValue("start_frame"),
+                pt.attribValue("end_frame"),
+            )
+            cache[bitmap_id, flip] = [
+                (
+                    raster.voxels_as_drawn(img, res, flip),
+                    None if mask is None else raster.voxels_as_drawn(mask, res, flip),
+                )
+                for _, res, img, mask in group
+            ]
+        return cache[bitmap_id, flip]
+
+    return frames
+
+
+def element_placements(library_geo, element_parms):
+    # raster.Placement per element with a bitmap, index being its position
+    # in the elements multiparm
+    frames = library_frames(library_geo)
+    return [
+        raster.Placement(
+            index,
+            pos_x,
+            pos_y,
+            depth,
+            len(frames(bitmap_id, flip)) > 1,
+            frames(bitmap_id, flip),
+        )
+        for index, (bitmap_id, pos_x, pos_y, depth, _, flip) in enumerate(
+            element_parms
+        )
+        if bitmap_id >= 0
+    ]
+
+
+# Range of the i16 depths and positions on the Playdate
+I16_MIN = -(1 << 15)
+I16_MAX = (1 << 15) - 1
+
+
+class LevelRangeError(hou.Error):
+    pass
+
+
+def check_i16(label, values):
+    for value in values:
+        if not I16_MIN <= value <= I16_MAX:
+            raise LevelRangeError(f"{label} {value} doesn't fit in an i16")
+
+
+def dense_depths(depths):
+    # Renumbers depths to 0..n-1 keeping their order, equal depths share a
+    # rank. Always fits the i16 z index unless there are over 32k depths.
+    _, ranks = numpy.unique(
+        numpy.asarray(depths, dtype=numpy.int64), return_inverse=True
+    )
+    if len(ranks) and ranks.max() > I16_MAX:
+        raise LevelRangeError(f"{ranks.max() + 1} distinct depths, max {I16_MAX + 1}")
+    return ranks.reshape(-1).tolist()
+
+
+def element_snapshot(node):
+    return multiparms.snapshot_multiparm(node, "elements", snapshot.ELEMENT_COLUMNS)
+
+
+def apply_elements(node, elements, label):
+    # Writes all the element instances back in one go and as a single undo
+    with hou.undos.group(label):
+        multiparms.write_multiparm(node, "elements", elements)
+
+
+def depth_order(elements, reverse=False):
+    # Stable, so elements at the same depth keep their relative order
+    depth = elements["depth#"].astype(numpy.int64)
+    return numpy.argsort(-depth if reverse else depth, kind="stable")
 
 
 def reorder_callback(kwargs):
     node = kwargs["node"]
     reverse = kwargs["script_value"] == "high_to_low"
-    elements = []
-    for element in iter_elements_parms(node):
-        elements.append(element)
-    print(elements)
-    node.parm("elements").set(0)
-    node.parm("elements").set(len(elements))
-    elements.sort(key=lambda x: x[3], reverse=reverse)
-    for element, parms in zip(elements, multiparm_iter(node.parm("elements"))):
-        bitmap_id, pos_x, pos_y, depth, foffset, flip = parms
-        bitmap_id.set(element[0])
-        pos_x.set(element[1])
-        pos_y.set(element[2])
-        depth.set(element[3])
-        foffset.set(element[4])
-        flip.set(element[5])
+    elements = element_snapshot(node)
+    apply_elements(
+        node, elements.take(depth_order(elements, reverse)), "Reorder elements"
+    )
+
+
+def sort_by_y_callback(kwargs):
+    # Auto depth from the bottom edge of every element, so whatever is lower
+    # on screen is drawn in front, then reorders by the new depth
+    node = kwargs["node"]
+    elements = element_snapshot(node)
+    library_res = {
+        pt.attribValue("bitmap_id"): pt.attribValue("res")[1]
+        for pt in node.node("bitmap_library").geometry().points()
+    }
+    heights = [library_res.get(i, 0) for i in elements["bitmap_id#"].tolist()]
+    elements["depth#"] = elements["position#"][:, 1] + numpy.array(heights)
+    apply_elements(node, elements.take(depth_order(elements)), "Sort elements by Y")
+
+
+def compact_depth_callback(kwargs):
+    # Renumbers the depths to 0..n-1 keeping their order, elements that
+    # shared a depth still do. The player's z index is its pixel Y, so this
+    # changes how the elements draw relative to the player: the player is in
+    # front of every element once it's below row n.
+    node = kwargs["node"]
+    elements = element_snapshot(node)
+    elements["depth#"] = dense_depths(elements["depth#"])
+    apply_elements(node, elements, "Compact element depths")
+
+
+def element_frame_holds(library_geo, pt):
+    # Ticks per exported frame of an element, empty unless held frames were
+    # collapsed (see one_bit.holds)
+    if library_geo.findPointAttrib("frame_holds") is None:
+        return []
+    return list(pt.attribValue("frame_holds"))
+
+
+def exported_duration(library_geo, pt):
+    # Number of bitmaps exported for an element
+    if pt.attribValue("static"):
+        return 1
+    frame_holds = element_frame_holds(library_geo, pt)
+    if frame_holds:
+        return len(frame_holds)
+    return pt.attribValue("end_frame") - pt.attribValue("start_frame") + 1
 
 
 def randomize_offsets_callback(kwargs):
@@ -81,19 +233,22 @@ def randomize_offsets_callback(kwargs):
 
     element_duration = {}
 
-    for pt in node.node("bitmap_library").geometry().points():
-        static = pt.attribValue("static")
-        start_frame = pt.attribValue("start_frame")
-        end_frame = pt.attribValue("end_frame")
+    library_geo = node.node("bitmap_library").geometry()
+    for pt in library_geo.points():
         bitmap_id = pt.attribValue("bitmap_id")
-        duration = None if static else end_frame - start_frame + 1
+        duration = None
+        if not pt.attribValue("static"):
+            duration = exported_duration(library_geo, pt)
         element_duration[bitmap_id] = duration
 
-    for parms in multiparm_iter(node.parm("elements")):
-        bitmap_id, _, _, _, foffset, _ = parms
-        duration = element_duration[bitmap_id.evalAsInt()]
+    elements = element_snapshot(node)
+    offsets = elements["frame_offset#"].tolist()
+    for i, bitmap_id in enumerate(elements["bitmap_id#"].tolist()):
+        duration = element_duration.get(bitmap_id)
         if duration is not None:
-            foffset.set(random.randint(0, duration-1))
+            offsets[i] = random.randint(0, duration - 1)
+    elements["frame_offset#"] = offsets
+    apply_elements(node, elements, "Randomize frame offsets")
 
 # {"level_name" : {
 #  {"sprites" : [
@@ -107,6 +262,9 @@ def randomize_offsets_callback(kwargs):
 #     {"frame_offset" : int},
 #     {"animated" : bool},
 #     {"duration" : int},
+#     {"holds" : [int, ...]},            (held frames only)
+#     {"sheet" : int},                   (atlas mode only)
+#     {"rect" : [int, int, int, int]},   (atlas mode only)
 #    }},
 #    {"sprite" : {
 #      ...
@@ -126,10 +284,51 @@ def randomize_offsets_callback(kwargs):
 #    }},
 #   ],
 #  ]},
+#  {"background" : {                     (baked background only)
+#   {"position" : [int, int]},
+#   {"depth" : int},
+#   {"resx" : int},
+#   {"resy" : int},
+#   {"has_mask" : bool},
+#   {"img" : str},
+#   {"img_mask" : str},                  (has_mask only)
+#  }},
 # }}
 
 
-def build_level(node):
+def bake_background(placements, depth):
+    # Composites the static sprites below depth that keep the draw order
+    # intact (see raster.bakeable) into one bitmap. Returns the background
+    # table of the level, None when nothing was baked, and the indices of
+    # the baked sprites.
+    baked = raster.bakeable(placements, depth)
+    if not baked:
+        return None, set()
+    baked = set(baked)
+    layer = [placement for placement in placements if placement.index in baked]
+    img, alpha = raster.composite(layer)
+    rect = raster.bounds(alpha)
+    if rect is None:
+        # Everything is off screen, nothing left to draw
+        return None, baked
+    x, y, resx, resy = rect
+    img = img[y : y + resy, x : x + resx]
+    alpha = alpha[y : y + resy, x : x + resx]
+    has_mask = not alpha.all()
+    background = {
+        "position": [x, y],
+        "depth": min(placement.depth for placement in layer),
+        "resx": resx,
+        "resy": resy,
+        "has_mask": bool(has_mask),
+        "img": raster.encode_drawn(img),
+    }
+    if has_mask:
+        background["img_mask"] = raster.encode_drawn(alpha)
+    return background, baked
+
+
+def build_level(node, report=None):
 
     # TODO: Possibly replace this with the info from the detail (ie: library_to_detail)
 
@@ -141,19 +340,29 @@ def build_level(node):
     # TODO: Renaming all usage of bitmap_id with element_id in Houdini.
     elements = []
     id_offset = 0
-    for pt in node.node("bitmap_library").geometry().points():
+    library_geo = node.node("bitmap_library").geometry()
+    has_trim = library_geo.findPointAttrib("trim_origin") is not None
+    has_atlas = library_geo.findPointAttrib("atlas_sheet") is not None
+    for pt in library_geo.points():
         static = pt.attribValue("static")
-        start_frame = pt.attribValue("start_frame")
-        end_frame = pt.attribValue("end_frame")
-        duration = 1 if static else end_frame - start_frame + 1
+        duration = exported_duration(library_geo, pt)
+        res = pt.attribValue("res")
+        trim_origin = pt.attribValue("trim_origin") if has_trim else [0, 0]
+        trim_res = pt.attribValue("trim_res") if has_trim else res
         elements.append(
             {
                 "animated": True if not static else False,
                 "duration": duration,
+                "frame_holds": element_frame_holds(library_geo, pt),
                 "bitmap_offset": id_offset,
+                "res": res,
+                "trim_origin": trim_origin,
+                "trim_res": trim_res,
+                "atlas_sheet": pt.attribValue("atlas_sheet") if has_atlas else -1,
+                "atlas_rect": pt.attribValue("atlas_rect") if has_atlas else None,
             }
         )
-        id_offset += 1 if static else duration
+        id_offset += duration
 
     export_elements = []
     level_name = (
@@ -177,15 +386,44 @@ def build_level(node):
             ],
         }
     }
-    for element_id, pos_x, pos_y, depth, foffset, flip in iter_elements_parms(node):
-        if element_id < 0:
+    element_parms = list(iter_elements_parms(node))
+    culled = set()
+    if parms.parm_value(node, "cull_hidden", False):
+        # Sprites fully covered by the ones in front of them
+        culled = set(
+            raster.hidden(element_placements(library_geo, element_parms))
+        )
+    baked = set()
+    if parms.parm_value(node, "bake_background", False):
+        # Static sprites below bake_depth drawn into a single bitmap
+        background, baked = bake_background(
+            [
+                placement
+                for placement in element_placements(library_geo, element_parms)
+                if placement.index not in culled
+            ],
+            int(parms.parm_value(node, "bake_depth", 0)),
+        )
+        if background is not None:
+            level_dict["level_data"]["background"] = background
+    # (depth, element index, sprite), emitted in draw order
+    placed = []
+    for index, element_parm in enumerate(element_parms):
+        element_id, pos_x, pos_y, depth, foffset, flip = element_parm
+        if element_id < 0 or index in culled or index in baked:
             continue
         element = elements[element_id]
         total_elements += 1
+        # Trimmed bitmaps are shifted so they stay where the full canvas was
+        offset_x, offset_y = trim.sprite_offset(
+            element["trim_origin"], element["res"], element["trim_res"], flip
+        )
+        position = [pos_x + offset_x, pos_y + offset_y]
+        check_i16(f"Element {index + 1} position", position)
         sprite = {
             "sprite": {
                 "bitmap_id": element["bitmap_offset"],
-                "position": [pos_x, pos_y],
+                "position": position,
                 "depth": depth,
                 "animated": element["animated"],
                 "duration": element["duration"],
@@ -193,10 +431,52 @@ def build_level(node):
                 "flip": flip,
             }
         }
+        if element["frame_holds"]:
+            # Ticks each frame is shown for, the Playdate only swaps images
+            # when a hold runs out
+            sprite["sprite"]["holds"] = element["frame_holds"]
+        if element["atlas_sheet"] >= 0:
+            # Packed into an atlas sheet (see one_bit.atlas), bitmap_id is the
+            # placeholder id of the bitmap in the library.
+            sprite["sprite"]["sheet"] = element["atlas_sheet"]
+            sprite["sprite"]["rect"] = list(element["atlas_rect"])
+        placed.append((depth, index, sprite))
+    # Sorted so the Playdate inserts the sprites in z order. The depths are
+    # kept as authored, they interleave with the player whose z index is its
+    # pixel Y. The baked background stays first at its depth (see
+    # Level.populate).
+    placed.sort(key=lambda p: p[:2])
+    for depth, index, sprite in placed:
+        check_i16(f"Element {index + 1} depth", (depth,))
         sprite_list.append(sprite)
+    background = level_dict["level_data"].get("background")
+    if background is not None:
+        check_i16("Background position", background["position"])
+        check_i16("Background depth", (background["depth"],))
     if total_elements:
         level_dict["level_data"]["sprites"][0][".total_sprites."] = total_elements
-    for ctype, xpos, ypos, resx, resy  in iter_colliders_parms(node):
+    colliders = list(iter_colliders_parms(node))
+    authored_colliders = len(colliders)
+    bitmap_ids = mask_collider_ids(node)
+    if bitmap_ids:
+        colliders.extend(
+            generate_mask_colliders(
+                node,
+                bitmap_ids,
+                tolerance=int(parms.parm_value(node, "collider_tolerance", 1)),
+                max_rects=int(
+                    parms.parm_value(
+                        node, "collider_max_rects", rects.DEFAULT_MAX_RECTS
+                    )
+                ),
+            )
+        )
+    generated_colliders = len(colliders) - authored_colliders
+    if parms.parm_value(node, "merge_colliders", False):
+        # Fewer, non overlapping rects per ctype (see one_bit.rects)
+        colliders = rects.merge_colliders(colliders)
+    for ctype, xpos, ypos, resx, resy in colliders:
+        check_i16(f"Collider {total_colliders + 1} position", (xpos, ypos))
         total_colliders += 1
         collider = {
             "collider": {
@@ -210,6 +490,17 @@ def build_level(node):
     if total_colliders:
         level_dict["level_data"]["colliders"][0][".total_colliders."] = total_colliders
 
+    if report is not None:
+        report["sprites"] = total_elements
+        # (element number, bitmap_id, position) of the culled sprites
+        report["culled"] = [
+            (index + 1, element_parms[index][0], element_parms[index][1:3])
+            for index in sorted(culled)
+        ]
+        report["baked"] = len(baked)
+        report["authored_colliders"] = authored_colliders
+        report["generated_colliders"] = generated_colliders
+        report["colliders"] = total_colliders
     return level_dict
 
 
@@ -220,60 +511,56 @@ def build_colliders_geo(node):
 
     bg_geo = node.input(1).geometry()
     bg_vol = bg_geo.prims()[0]
-    xres, yres, zres = bg_vol.resolution()
-    max_res = max(*bg_vol.resolution())
-    xratio = xres/max_res
-    yratio = yres/max_res
-
-    colliders = geo.attribValue("parms")["colliders"]
-
-    sop_cat = hou.sopNodeTypeCategory()
-    grid_verb = sop_cat.nodeVerb("grid")
-    primitive_verb = sop_cat.nodeVerb("primitive")
-    resample_verb = sop_cat.nodeVerb("resample")
-    add_verb = sop_cat.nodeVerb("add")
-    #polyextrude_verb = sop_cat.nodeVerb("polyextrude::2.0")
-    font_verb = sop_cat.nodeVerb("font")
-    primitive_verb.setParms({"closeu" : 5,})
-    #polyextrude_verb.setParms({"dist": -0.01,})
-    resample_verb.setParms({
-        "edge": 1,
-        "length": 0.025,
-        "onlypoints" : 1,
-    })
-    add_verb.setParms({
-        "switcher" : 1,
-        "add": 1,
-    })
-    for collider in colliders:
-        if collider["collider_type#"] == 0:
-            continue
+    res = bg_vol.resolution()[:2]
+
+    colliders = snapshot.MultiparmSnapshot(
+        [
+            row
+            for row in geo.attribValue("parms")["colliders"]
+            if row["collider_type#"] != 0
+        ],
+        snapshot.COLLIDER_COLUMNS,
+    )
+    if not len(colliders):
+        return
 
-        new_geo = hou.Geometry()
-        size_x = collider["collider_size#"][0]/max_res*2
-        size_y = collider["collider_size#"][1]/max_res*2
-        pos_x = (collider["collider_pos#"][0]/max_res*2)+size_x/2 - xratio
-        pos_y = 1*yratio - (collider["collider_pos#"][1]/max_res*2)-size_y/2
-        grid_verb.setParms({
-            "size": hou.Vector2(size_x, size_y),
-            "rows": 2,
-            "cols": 2,
-            "orient": 0,
-            "t": hou.Vector3(pos_x, pos_y, 0.0),
-        })
-        grid_verb.execute(new_geo, [])
-        primitive_verb.execute(new_geo, [new_geo,])
-        Cd_atr = new_geo.addAttrib(hou.attribType.Prim, "Cd", [1.0, 1.0, 1.0], create_local_variable=False)
-        nprims = len(new_geo.iterPrims())
-        flood_colors = list(itertools.chain(list(collider["collider_color#"])*nprims))
-        new_geo.setPrimFloatAttribValues("Cd", flood_colors)
-        geo.merge(new_geo)
+    # Every outline is created in one go and merged once, instead of a grid
+    # and primitive verb (and a merge) per collider
+    points, outlines = rects.preview_outlines(
+        colliders["collider_pos#"], colliders["collider_size#"], res
+    )
+    new_geo = hou.Geometry()
+    new_points = new_geo.createPoints(points.tolist())
+    new_geo.createPolygons(
+        [[new_points[i] for i in outline] for outline in outlines.tolist()],
+        is_closed=False,
+    )
+    new_geo.addAttrib(
+        hou.attribType.Prim, "Cd", (1.0, 1.0, 1.0), create_local_variable=False
+    )
+    new_geo.setPrimFloatAttribValuesFromString(
+        "Cd", colliders["collider_color#"].astype(numpy.float32).tobytes()
+    )
+    geo.merge(new_geo)
+
+
+def print_report(report):
+    for number, bitmap_id, position in report["culled"]:
+        print(f"Culled hidden element {number} (bitmap {bitmap_id} at {position})")
+    if report["baked"]:
+        print(f"Baked {report['baked']} static sprites into the background")
+    print(
+        f"Exported {report['sprites']} sprites, {report['colliders']} colliders "
+        f"({report['authored_colliders']} authored, "
+        f"{report['generated_colliders']} generated from masks)"
+    )
 
 
 def export_callback(node):
     path = node.parm("export_path").eval()
     if not path:
         return
-    level_export = build_level(node)
-    with open(path, "w") as json_f:
-        json.dump(level_export, json_f, indent=1)
+    report = {}
+    level_export = build_level(node, report=report)
+    json_stream.dump_file(level_export, path, indent=parms.json_indent(node))
+    print_report(report)
@@ -1,6 +1,14 @@
-import hou
 import json
 
+import hou
+
+from one_bit import json_stream
+from one_bit import map_layout
+from one_bit import parms
+from one_bit import residency
+from one_bit import snapshot
+from one_bit.otls import multiparms
+
 # TODO the naming is all over the map (hurrr) and should stick
 # to one convention
 
@@ -79,11 +87,24 @@ class ConnectsTo:
 #           "west" : int | null,
 #           "north" : int | null,
 #           "south" : int | null,
+#           "prefetch" : [int, ...],      (residency plan only)
+#           "evict" : [int, ...],         (residency plan only)
 #       }},
 #   ]},
 # }
 
 
+def iter_connections(node):
+    # Yields (level_a, level_b, dir_id) per connection of the levels multiparm
+    connections = multiparms.snapshot_multiparm(
+        node,
+        "levels",
+        snapshot.CONNECTION_COLUMNS,
+        menus=("level_a#", "level_b#"),
+    )
+    yield from connections.rows("level_a#", "level_b#", "placement#")
+
+
 def export_map(node):
 
     level_to_id = {}
@@ -102,14 +123,9 @@ def export_map(node):
         "levels" : levels,
     }}
 
-    edges = node.parm("levels").evalAsInt()
     spawned_levels = set()
     connections = {}
-    for edge in range(1,edges+1):
-        a = node.parm(f"level_a{edge}").evalAsString()
-        b = node.parm(f"level_b{edge}").evalAsString()
-        dir_id = node.parm(f"placement{edge}").evalAsInt()
-
+    for a, b, dir_id in iter_connections(node):
         spawned_levels.add(a)
         spawned_levels.add(b)
         if a not in connections:
@@ -129,23 +145,87 @@ def export_map(node):
                 }}
         level["level"].update(connections.get(level_name, ConnectsTo()).as_dict())
         levels.append(level)
+    add_residency_plan(node, export_map)
     return export_map
 
+
+def add_residency_plan(node, map_export):
+    # Levels to prefetch and the eviction order per level (see
+    # one_bit.residency), sized from the report of one_bit.sublibrary and
+    # bounded by prefetch_budget bytes, core library included
+    budget = int(parms.parm_value(node, "prefetch_budget", 0))
+    report_path = parms.parm_value(node, "residency_report", "")
+    if not budget or not report_path:
+        return
+    with open(report_path) as report_f:
+        sublibrary_report = json.load(report_f)
+    names, neighbours = residency.map_graph(map_export)
+    missing = residency.missing_levels(names, sublibrary_report)
+    if missing:
+        raise hou.NodeError(
+            f"{report_path} has no sizes for {', '.join(missing)}, rebuild it "
+            "with one_bit.sublibrary"
+        )
+    sizes, core_bytes = residency.level_sizes(names, sublibrary_report)
+    plan = residency.plan_map(
+        neighbours,
+        sizes,
+        budget - core_bytes,
+        int(parms.parm_value(node, "prefetch_radius", residency.DEFAULT_RADIUS)),
+    )
+    level_tables = [
+        entry["level"] for entry in map_export["map"]["levels"] if "level" in entry
+    ]
+    for level_id, level in enumerate(level_tables):
+        level.update(plan[level_id])
+
+
+# Both caches live in the cached user data of the HDA, so they go away with
+# the node and aren't saved with the hip file.
+
+
+def cached_layout(hda, edges):
+    # Viewport recooks only redo the layout when the connections changed,
+    # cached as (connections key, map_layout.Layout)
+    key = map_layout.connections_key(edges)
+    cached = hda.cachedUserData("one_bit_layout")
+    if cached is None or cached[0] != key:
+        cached = (key, map_layout.layout(edges))
+        hda.setCachedUserData("one_bit_layout", cached)
+    return cached[1]
+
+
+def frozen_inputs(hda):
+    # Inputs are only frozen again after they recook, the preview embeds the
+    # same frozen geometry in its packed prims on every cook. Returns {input
+    # name : frozen geometry}, cached as {input session id : (cook count,
+    # frozen geometry)} and pruned to the inputs still connected.
+    cached = hda.cachedUserData("one_bit_frozen_inputs") or {}
+    frozen = {}
+    geos = {}
+    for input_node in hda.inputs():
+        cook_count = input_node.cookCount()
+        entry = cached.get(input_node.sessionId())
+        if entry is None or entry[0] != cook_count:
+            entry = (cook_count, input_node.geometry().freeze())
+        frozen[input_node.sessionId()] = entry
+        geos[input_node.name()] = entry[1]
+    hda.setCachedUserData("one_bit_frozen_inputs", frozen)
+    return geos
+
+
 def layout_map(node):
     node = hou.pwd()
     hda = node.parent()
     geo = node.geometry()
 
-    geos = {}
+    geos = frozen_inputs(hda)
     level_to_id = {}
     level_ids = []
     for i,n in enumerate(hda.inputs()):
-        geos[n.name()] = n.geometry().freeze()
         level_to_id[n.name()] = i
         level_ids.append(n)
 
-    level_connections = hda.parm("levels").evalAsInt()
-
     skel_geo = hou.Geometry()
 
     level_pts = {}
@@ -156,10 +236,7 @@ def layout_map(node):
     ## Build Edges and Points
 
     edges = []
-    for edge_num in range(level_connections):
-        a = hda.parm(f"level_a{edge_num+1}").evalAsString()
-        b = hda.parm(f"level_b{edge_num+1}").evalAsString()
-        dir_id = hda.parm(f"placement{edge_num+1}").evalAsInt()
+    for a, b, dir_id in iter_connections(hda):
         direction = dir_id_to_name[dir_id]
 
         # reorder so preferring left of and south_of
@@ -179,7 +256,7 @@ def layout_map(node):
         if pt_b is None:
             pt_b = skel_geo.createPoint()
             pt_b.setAttribValue(name_atr, b)
-            pt_a.setAttribValue(level_id_atr, level_to_id[b])
+            pt_b.setAttribValue(level_id_atr, level_to_id[b])
             level_pts[b] = pt_b
 
         poly = skel_geo.createPolygon(is_closed=False)
@@ -190,47 +267,21 @@ def layout_map(node):
     space_x = 2 + hda.parm("padding").eval()
     space_y = 240/400*space_x
 
-    check_queue = [[edges[0][0], hou.Vector3(0,0,0)],]
-    checked = set()
-
     # Layout Points
 
-    emergency_escape = 0
-    while check_queue and emergency_escape < 1000:
-        emergency_escape+=1
-
-        check, pos = check_queue.pop()
-        checked.add(check)
-        for edge in edges:
-            a,b,direction = edge
-            if check == a:
-                if direction == "west_of":
-                    d = hou.Vector3(space_x, 0, 0)
-                else:
-                    d = hou.Vector3(0, -space_y, 0)
-                to_check = b
-            elif check == b:
-                if direction == "west_of":
-                    d = hou.Vector3(-space_x, 0, 0)
-                else:
-                    d = hou.Vector3(0, space_y, 0)
-                to_check = a
-            else:
-                continue
-
-            new_pos = pos + d
-            level_pts[to_check].setPosition(new_pos)
-            if to_check not in checked:
-                check_queue.append([to_check, new_pos])
-
-    ## Copy Levels to Points
+    layout = cached_layout(hda, edges)
+    for level, (x, y) in layout.cells.items():
+        level_pts[level].setPosition(hou.Vector3(x * space_x, y * space_y, 0))
+
+    ## Instance Levels to Points
 
+    # Packed prims sharing the frozen inputs, so the preview costs a prim per
+    # level instead of a copy of all the voxels of the world
     for pt in skel_geo.iterPoints():
         pt_name = pt.attribValue(name_atr)
-        input_geo = geos[pt_name]
-        xform = hou.hmath.buildTranslate(pt.position())
-        input_geo.transform(xform)
-        geo.merge(input_geo)
+        packed = geo.createPacked("PackedGeometry")
+        packed.setEmbeddedGeometry(geos[pt_name])
+        packed.vertex(0).point().setPosition(pt.position())
 
     if hda.parm("show_skel").eval():
         geo.merge(skel_geo)
@@ -262,9 +313,9 @@ def layout_map(node):
         sphere_geo.prims()[0].setAttribValue(cd_atr, [0.,0.,1.])
         geo.merge(sphere_geo)
 
-    if len(checked) < len(level_pts):
-        unconnected = set(level_pts) - checked
-        raise hou.NodeWarning(f"{', '.join(unconnected)} not connected")
+    problems = map_layout.problems(layout)
+    if problems:
+        raise hou.NodeWarning("\n".join(problems))
 
 
 def export_callback(kwargs):
@@ -273,6 +324,5 @@ def export_callback(kwargs):
     if not path:
         return
     map_export = export_map(node)
-    with open(path, "w") as json_f:
-        json.dump(map_export, json_f, indent=1)
+    json_stream.dump_file(map_export, path, indent=parms.json_indent(node))
 
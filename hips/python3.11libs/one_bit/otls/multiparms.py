@@ -0,0 +1,95 @@
+import hou
+
+from one_bit import snapshot
+
+# Multiparm helpers shared by the one_bit HDAs.
+
+ignored_parm_templates = (
+    hou.ButtonParmTemplate,
+    hou.FolderParmTemplate,
+    hou.FolderSetParmTemplate,
+    hou.LabelParmTemplate,
+    hou.SeparatorParmTemplate,
+)
+
+
+def multiparm_iter(parm):
+    parms = parm.multiParmInstances()
+    num = parm.multiParmInstancesPerItem()
+    for i in range(0, len(parms), num):
+        yield [
+            p
+            for p in parms[i : i + num]
+            if not isinstance(p.parmTemplate(), ignored_parm_templates)
+        ]
+
+
+def _eval_rows(parm):
+    # Slow path, one HOM call per parm tuple of every instance
+    rows = []
+    for instance in multiparm_iter(parm):
+        row = {}
+        for parm_tuple in dict.fromkeys(p.tuple() for p in instance):
+            value = parm_tuple.eval()
+            row[parm_tuple.parmTemplate().name()] = (
+                value[0] if len(value) == 1 else list(value)
+            )
+        rows.append(row)
+    return rows
+
+
+def multiparm_rows(node, name):
+    # Every instance of a multiparm as a list of {"parm#" : value} rows, in a
+    # single parmsAsData call when this Houdini has it
+    try:
+        data = node.parmsAsData(evaluate=True, brief=False)
+    except (AttributeError, TypeError):
+        data = None
+    rows = data.get(name) if isinstance(data, dict) else None
+    if not isinstance(rows, list):
+        rows = _eval_rows(node.parm(name))
+    return rows
+
+
+def menu_tokens(node, name, column):
+    # Ordinal menus come back as the index of the item, resolve them to the
+    # tokens through the menu of the first instance
+    parm = node.parm(name.replace("#", "1"))
+    if parm is None:
+        return column
+    tokens = parm.menuItems()
+    return [
+        tokens[value] if isinstance(value, int) and value < len(tokens) else value
+        for value in column
+    ]
+
+
+def snapshot_multiparm(node, name, columns, menus=()):
+    # Column snapshot of a multiparm, menus are the names of ordinal parms to
+    # resolve to their tokens
+    rows = multiparm_rows(node, name)
+    for menu in menus:
+        tokens = menu_tokens(node, menu, [row[menu] for row in rows])
+        for row, token in zip(rows, tokens):
+            row[menu] = token
+    return snapshot.MultiparmSnapshot(rows, columns)
+
+
+def write_multiparm(node, name, instances):
+    # Replaces every instance of a multiparm with the rows of a snapshot in
+    # one batched call, wrap it in a hou.undos.group to get a single undo
+    rows = instances.as_rows()
+    try:
+        node.setParmsFromData({name: rows})
+        return
+    except (AttributeError, TypeError):
+        pass
+    # Older Houdini, still a single setParms for all the instances
+    parm = node.parm(name)
+    parm.set(len(rows))
+    offset = parm.multiParmStartOffset()
+    values = {}
+    for i, row in enumerate(rows):
+        for parm_name, value in row.items():
+            values[parm_name.replace("#", str(i + offset))] = value
+    node.setParms(values)
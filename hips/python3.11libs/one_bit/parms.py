@@ -0,0 +1,14 @@
+# Parm helpers shared by the one_bit HDAs
+
+
+def parm_value(node, name, default):
+    # Optional parms that older versions of the HDAs might not have
+    parm = node.parm(name)
+    if parm is None:
+        return default
+    return parm.eval()
+
+
+def json_indent(node):
+    # Exports are indented unless the HDA has compact_json enabled
+    return None if parm_value(node, "compact_json", False) else 1
@@ -0,0 +1,167 @@
+import collections
+
+import numpy
+
+from one_bit import bitpack
+
+# Software rasterization of a level, as the Playdate sprite system draws it.
+#
+# Sprites are drawn in (depth, index) order with their top left corner at
+# their position. A masked bitmap only covers its opaque pixels, an unmasked
+# one is an opaque rect. Bitmaps are stored bottom row first and the Playdate
+# flips them in Y (and X for flipped sprites), the arrays here are always as
+# drawn: rows top down, already mirrored.
+#
+# frames is a list of (img, mask) bool arrays per frame, one for static
+# sprites. img is True for white pixels, mask True for opaque ones.
+
+SCREEN_WIDTH = 400
+SCREEN_HEIGHT = 240
+
+Placement = collections.namedtuple(
+    "Placement", ["index", "x", "y", "depth", "animated", "frames"]
+)
+
+
+def voxels_as_drawn(voxels, res, flip=False):
+    bits = numpy.frombuffer(voxels, dtype=numpy.float32).reshape(res[1], res[0])
+    bits = bits[::-1]
+    if flip:
+        bits = bits[:, ::-1]
+    return bits != 0
+
+
+def opaque(img, mask):
+    return numpy.ones(img.shape, dtype=bool) if mask is None else mask
+
+
+def union_mask(placement):
+    # Pixels covered in any frame
+    masks = [opaque(img, mask) for img, mask in placement.frames]
+    return numpy.logical_or.reduce(masks)
+
+
+def solid_mask(placement):
+    # Pixels covered in every frame
+    masks = [opaque(img, mask) for img, mask in placement.frames]
+    return numpy.logical_and.reduce(masks)
+
+
+def draw_order(placements):
+    return sorted(placements, key=lambda p: (p.depth, p.index))
+
+
+def screen_slices(placement, shape, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    # (screen, local) slices of the part of the sprite that is on screen, None
+    # when it's fully off screen
+    rows, cols = shape
+    x0, y0 = max(placement.x, 0), max(placement.y, 0)
+    x1 = min(placement.x + cols, width)
+    y1 = min(placement.y + rows, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    screen = (slice(y0, y1), slice(x0, x1))
+    local = (
+        slice(y0 - placement.y, y1 - placement.y),
+        slice(x0 - placement.x, x1 - placement.x),
+    )
+    return screen, local
+
+
+def hidden(placements, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    # Indices of the sprites with no visible pixel, walking from the top
+    # sprite down with a buffer of the pixels already covered. Animated
+    # sprites are only hidden when every frame is, and only occlude what
+    # they cover in every frame.
+    covered = numpy.zeros((height, width), dtype=bool)
+    hidden_indices = []
+    for placement in reversed(draw_order(placements)):
+        cover = union_mask(placement)
+        slices = screen_slices(placement, cover.shape, width, height)
+        if slices is None:
+            hidden_indices.append(placement.index)
+            continue
+        screen, local = slices
+        if not (cover[local] & ~covered[screen]).any():
+            hidden_indices.append(placement.index)
+            continue
+        covered[screen] |= solid_mask(placement)[local]
+    return sorted(hidden_indices)
+
+
+def overlapping(a, b):
+    # Whether the bounds of two placements overlap
+    (a_rows, a_cols), (b_rows, b_cols) = a.frames[0][0].shape, b.frames[0][0].shape
+    return (
+        a.x < b.x + b_cols
+        and b.x < a.x + a_cols
+        and a.y < b.y + b_rows
+        and b.y < a.y + a_rows
+    )
+
+
+def bakeable(placements, depth):
+    # Indices of the static sprites below depth that can be baked into a
+    # single background layer, drawn at the depth of the lowest one and
+    # before any other sprite of that depth. A sprite can't be baked when a
+    # sprite left out of the layer, but not below it, is drawn under it and
+    # overlaps it. Leaving a sprite out can rule out the ones above it, so
+    # this runs until nothing changes.
+    order = draw_order(placements)
+    baked = {p.index for p in order if not p.animated and p.depth < depth}
+    changed = True
+    while changed and baked:
+        changed = False
+        layer_depth = min(p.depth for p in order if p.index in baked)
+        for i, placement in enumerate(order):
+            if placement.index not in baked:
+                continue
+            if any(
+                below.index not in baked
+                and below.depth >= layer_depth
+                and overlapping(below, placement)
+                for below in order[:i]
+            ):
+                baked.discard(placement.index)
+                changed = True
+    return sorted(baked)
+
+
+def composite(placements, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    # Paints the first frame of placements in draw order, returns the (img,
+    # alpha) screen buffers. alpha is True wherever a sprite covers the pixel.
+    img = numpy.zeros((height, width), dtype=bool)
+    alpha = numpy.zeros((height, width), dtype=bool)
+    for placement in draw_order(placements):
+        frame_img, frame_mask = placement.frames[0]
+        slices = screen_slices(placement, frame_img.shape, width, height)
+        if slices is None:
+            continue
+        screen, local = slices
+        cover = opaque(frame_img, frame_mask)[local]
+        img[screen] = numpy.where(cover, frame_img[local], img[screen])
+        alpha[screen] |= cover
+    return img, alpha
+
+
+def bounds(alpha):
+    # (x, y, width, height) of the covered pixels, None when there are none
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    cols = numpy.flatnonzero(alpha.any(axis=0))
+    if not rows.size:
+        return None
+    return (
+        int(cols[0]),
+        int(rows[0]),
+        int(cols[-1] - cols[0] + 1),
+        int(rows[-1] - rows[0] + 1),
+    )
+
+
+def encode_drawn(bits):
+    # Inverse of voxels_as_drawn for an unflipped bitmap, back to the padded
+    # bottom row first layout of the library, base64 encoded
+    resy, resx = bits.shape
+    padded = numpy.zeros((resy, bitpack.padded_width(resx)), dtype=bool)
+    padded[:, :resx] = bits[::-1]
+    return bitpack.encode_packed(numpy.packbits(padded, axis=-1))
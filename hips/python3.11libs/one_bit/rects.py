@@ -0,0 +1,160 @@
+import itertools
+
+import numpy
+
+# Merging of collider rectangles.
+#
+# Every collider ends up as a sprite (and a bitmap) on the Playdate that takes
+# part in the collision checks, so the authored rects of each ctype are
+# replaced by a small set of non overlapping rects covering exactly the same
+# pixels.
+#
+# The rects are rasterized on a grid compressed to the unique rect edges, so
+# the cost depends on the number of rects and not on their size, then
+# covered with horizontal runs stacked into rects where consecutive rows have
+# the same run.
+#
+# Rects are (x, y, w, h) in pixels.
+#
+# Colliders can also be generated from sprite masks. The mask is coarsened to
+# blocks of tolerance pixels (a block is solid when at least half of it is),
+# so a higher tolerance gives fewer but less accurate rects, and the block
+# size keeps doubling until the cover fits in max_rects.
+
+DEFAULT_MAX_RECTS = 16
+
+
+def _coverage(rects):
+    xs = numpy.unique([c for x, _, w, _ in rects for c in (x, x + w)])
+    ys = numpy.unique([c for _, y, _, h in rects for c in (y, y + h)])
+    grid = numpy.zeros((len(ys) - 1, len(xs) - 1), dtype=bool)
+    for x, y, w, h in rects:
+        c0, c1 = numpy.searchsorted(xs, (x, x + w))
+        r0, r1 = numpy.searchsorted(ys, (y, y + h))
+        grid[r0:r1, c0:c1] = True
+    return grid, xs, ys
+
+
+def cover(grid):
+    # Cover of the True cells as (col, row, cols, rows) blocks. Every row is
+    # split in runs, then runs spanning the same columns in consecutive rows
+    # are stacked into one block.
+    grid = numpy.asarray(grid, dtype=bool)
+    if not grid.any():
+        return []
+    padded = numpy.zeros((grid.shape[0], grid.shape[1] + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = grid
+    edges = numpy.diff(padded, axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    _, ends = numpy.nonzero(edges == -1)
+
+    order = numpy.lexsort((rows, ends, starts))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    stacked = numpy.zeros(rows.size, dtype=bool)
+    stacked[1:] = (
+        (starts[1:] == starts[:-1])
+        & (ends[1:] == ends[:-1])
+        & (rows[1:] == rows[:-1] + 1)
+    )
+    first = numpy.flatnonzero(~stacked)
+    heights = numpy.diff(numpy.append(first, rows.size))
+    blocks = numpy.stack(
+        (starts[first], rows[first], ends[first] - starts[first], heights), axis=1
+    )
+    # Row major like the grid
+    blocks = blocks[numpy.lexsort((blocks[:, 0], blocks[:, 1]))]
+    return [tuple(int(v) for v in block) for block in blocks]
+
+
+def merge_rects(rects):
+    rects = [r for r in rects if r[2] > 0 and r[3] > 0]
+    if len(rects) < 2:
+        return [tuple(r) for r in rects]
+    grid, xs, ys = _coverage(rects)
+    return [
+        (
+            int(xs[c]),
+            int(ys[r]),
+            int(xs[c + cols] - xs[c]),
+            int(ys[r + rows] - ys[r]),
+        )
+        for c, r, cols, rows in cover(grid)
+    ]
+
+
+def coarsen(mask, block):
+    if block <= 1:
+        return mask.astype(bool)
+    rows = -(-mask.shape[0] // block)
+    cols = -(-mask.shape[1] // block)
+    padded = numpy.zeros((rows * block, cols * block), dtype=numpy.float32)
+    padded[: mask.shape[0], : mask.shape[1]] = mask
+    return padded.reshape(rows, block, cols, block).mean(axis=(1, 3)) >= 0.5
+
+
+def mask_rects(mask, tolerance=1, max_rects=DEFAULT_MAX_RECTS):
+    # mask is a 2D array, rows top down as drawn on screen. Returns the
+    # (x, y, w, h) rects covering it, relative to its top left corner.
+    height, width = mask.shape
+    block = max(1, int(tolerance))
+    while True:
+        blocks = cover(coarsen(mask, block))
+        if len(blocks) <= max_rects or block >= max(height, width):
+            break
+        block *= 2
+    rects = []
+    for c, r, cols, rows in blocks:
+        x, y = c * block, r * block
+        w = min(cols * block, width - x)
+        h = min(rows * block, height - y)
+        rects.append((x, y, w, h))
+    return rects
+
+
+def merge_colliders(colliders):
+    # colliders is a list of (ctype, x, y, w, h), rects are only merged with
+    # others of the same ctype. The ctypes keep their first appearance order,
+    # and their authored rects when merging wouldn't make them fewer.
+    ctypes = list(dict.fromkeys(c[0] for c in colliders))
+    merged = []
+    for ctype in ctypes:
+        rects = [tuple(c[1:]) for c in colliders if c[0] == ctype]
+        cover_rects = merge_rects(rects)
+        if len(cover_rects) >= len(rects):
+            cover_rects = rects
+        merged.extend((ctype, *rect) for rect in cover_rects)
+    return merged
+
+
+def pixel_area(rects):
+    # Pixels covered, counting overlaps once
+    if not rects:
+        return 0
+    grid, xs, ys = _coverage(rects)
+    cell_area = numpy.outer(numpy.diff(ys), numpy.diff(xs))
+    return int(cell_area[grid].sum())
+
+
+def overlaps(rects):
+    for (ax, ay, aw, ah), (bx, by, bw, bh) in itertools.combinations(rects, 2):
+        if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+            return True
+    return False
+
+
+def preview_outlines(positions, sizes, res):
+    # Corners of collider rects in the space of the level preview, the
+    # background volume fits in -1..1 along its longest side with y up.
+    # positions and sizes are (n, 2) pixel arrays, res the (x, y) res of
+    # the background. Returns the (n * 4, 3) points and the (n, 5) point
+    # numbers of closed outlines (the first point is repeated).
+    scale = 2 / max(res)
+    x0 = positions[:, 0] * scale - res[0] / max(res)
+    y1 = res[1] / max(res) - positions[:, 1] * scale
+    x1 = x0 + sizes[:, 0] * scale
+    y0 = y1 - sizes[:, 1] * scale
+    points = numpy.zeros((len(positions), 4, 3), dtype=numpy.float32)
+    points[:, :, 0] = numpy.stack([x0, x1, x1, x0], axis=1)
+    points[:, :, 1] = numpy.stack([y1, y1, y0, y0], axis=1)
+    outlines = numpy.arange(len(positions) * 4).reshape(-1, 4)
+    return points.reshape(-1, 3), numpy.concatenate([outlines, outlines[:, :1]], 1)
@@ -0,0 +1,222 @@
+import argparse
+import collections
+import json
+import random
+
+# Prefetch and eviction plans for the levels of a map.
+#
+# While the player is in a level, the levels it connects to are the next
+# ones to load. A plan lists per level:
+#   prefetch  levels to load ahead of a level switch, nearest first, up to
+#             radius connections away and only as long as they fit in the
+#             budget along with the level itself
+#   evict     every other level, the ones furthest away (unreachable
+#             first) and then the largest ones go first
+#
+# sizes are the resident bytes of each level, ie the chunk and background
+# bytes from one_bit.sublibrary, the budget is what's left for them once the
+# core library is loaded. Levels are the ids of the exported map.
+#
+# simulate replays a walk through the map with a plan and counts the level
+# switches that found the level already loaded (hits) or had to load it
+# (misses), along with the peak resident bytes:
+#
+#   python -m one_bit.residency ../../assets/map.json --sizes world/r.json \
+#       --budget 16384 --steps 500
+
+DEFAULT_RADIUS = 1
+RADII = (0, 1, 2)
+
+Stats = collections.namedtuple(
+    "Stats", ["hits", "misses", "prefetched", "evicted", "peak_bytes"]
+)
+
+
+def map_graph(map_export):
+    # Level names and {level id : [connected level ids]} of an exported map
+    names = []
+    neighbours = {}
+    for entry in map_export["map"]["levels"]:
+        level = entry.get("level")
+        if level is None:
+            continue
+        level_id = len(names)
+        names.append(level["name"])
+        neighbours[level_id] = [
+            level[direction]
+            for direction in ("east", "north", "west", "south")
+            if level.get(direction) is not None
+        ]
+    return names, neighbours
+
+
+def distances(neighbours, start):
+    # Connections from start to every reachable level
+    hops = {start: 0}
+    queue = collections.deque([start])
+    while queue:
+        level = queue.popleft()
+        for other in neighbours[level]:
+            if other not in hops:
+                hops[other] = hops[level] + 1
+                queue.append(other)
+    return hops
+
+
+def plan_level(level, neighbours, sizes, budget, radius=DEFAULT_RADIUS):
+    hops = distances(neighbours, level)
+    nearby = sorted(
+        (other for other, hop in hops.items() if 0 < hop <= radius),
+        key=lambda other: (hops[other], sizes[other], other),
+    )
+    prefetch = []
+    used = sizes[level]
+    for other in nearby:
+        if used + sizes[other] <= budget:
+            prefetch.append(other)
+            used += sizes[other]
+    evict = sorted(
+        (other for other in neighbours if other != level),
+        key=lambda other: (-hops.get(other, len(neighbours)), -sizes[other], other),
+    )
+    return {"prefetch": prefetch, "evict": evict}
+
+
+def plan_map(neighbours, sizes, budget, radius=DEFAULT_RADIUS):
+    return {
+        level: plan_level(level, neighbours, sizes, budget, radius)
+        for level in neighbours
+    }
+
+
+def simulate(plan, sizes, budget, walk):
+    # Replays walk (level ids in visiting order) and returns its Stats. A
+    # level bigger than the budget on its own is still loaded.
+    resident = set()
+    used = 0
+    hits = misses = prefetched = evicted = 0
+    peak = 0
+
+    def make_room(level, needed, keep):
+        nonlocal used, evicted
+        for other in plan[level]["evict"]:
+            if used + needed <= budget:
+                return
+            if other in resident and other not in keep:
+                resident.discard(other)
+                used -= sizes[other]
+                evicted += 1
+
+    for level in walk:
+        keep = {level, *plan[level]["prefetch"]}
+        if level in resident:
+            hits += 1
+        else:
+            misses += 1
+            make_room(level, sizes[level], keep)
+            resident.add(level)
+            used += sizes[level]
+        for other in plan[level]["prefetch"]:
+            if other in resident:
+                continue
+            make_room(level, sizes[other], keep)
+            if used + sizes[other] <= budget:
+                resident.add(other)
+                used += sizes[other]
+                prefetched += 1
+        peak = max(peak, used)
+    return Stats(hits, misses, prefetched, evicted, peak)
+
+
+def random_walk(neighbours, start, steps, seed=0):
+    # A walk taking a random connection at every level switch
+    rng = random.Random(seed)
+    walk = [start]
+    for _ in range(steps):
+        if not neighbours[walk[-1]]:
+            break
+        walk.append(rng.choice(neighbours[walk[-1]]))
+    return walk
+
+
+def missing_levels(names, sublibrary_report):
+    # Names of the levels the one_bit.sublibrary report has no sizes for
+    return [name for name in names if name not in sublibrary_report["levels"]]
+
+
+def level_sizes(names, sublibrary_report=None):
+    # Resident bytes per level id and the core bytes from a one_bit.sublibrary
+    # report, every level counts the same without one. The report must have
+    # every level of names (see missing_levels).
+    if sublibrary_report is None:
+        return {level_id: 1 for level_id in range(len(names))}, 0
+    levels = sublibrary_report["levels"]
+    sizes = {
+        level_id: levels[name]["chunk_bytes"] + levels[name]["background_bytes"]
+        for level_id, name in enumerate(names)
+    }
+    return sizes, sublibrary_report["core_bytes"]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Map prefetch / residency plans")
+    parser.add_argument("map", help="exported map.json")
+    parser.add_argument("--sizes", help="report written by one_bit.sublibrary")
+    parser.add_argument(
+        "--budget", type=int, required=True, help="bytes for the levels and core"
+    )
+    parser.add_argument("--walk", nargs="*", help="level names to visit in order")
+    parser.add_argument("--steps", type=int, default=200, help="random walk length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--plan", help="write the plan of the default radius")
+    args = parser.parse_args(args)
+
+    with open(args.map) as map_f:
+        map_export = json.load(map_f)
+    names, neighbours = map_graph(map_export)
+    sublibrary_report = None
+    if args.sizes:
+        with open(args.sizes) as sizes_f:
+            sublibrary_report = json.load(sizes_f)
+        missing = missing_levels(names, sublibrary_report)
+        if missing:
+            parser.error(f"{args.sizes} has no sizes for {', '.join(missing)}")
+    sizes, core_bytes = level_sizes(names, sublibrary_report)
+    budget = args.budget - core_bytes
+    if args.walk:
+        unknown = [name for name in args.walk if name not in names]
+        if unknown:
+            parser.error(f"--walk levels not in the map: {', '.join(unknown)}")
+        level_ids = {name: level_id for level_id, name in enumerate(names)}
+        walk = [level_ids[name] for name in args.walk]
+    else:
+        start = map_export["map"][".starting_level."]
+        walk = random_walk(neighbours, start, args.steps, args.seed)
+
+    print(f"{len(walk)} levels visited, {budget} bytes for levels after the core")
+    too_big = [names[level] for level, size in sizes.items() if size > budget]
+    if too_big:
+        print(f"Over the budget on their own: {', '.join(too_big)}")
+    print(
+        f"{'radius':<8}{'hits':>6}{'misses':>8}{'prefetched':>12}{'evicted':>9}"
+        f"{'peak':>10}"
+    )
+    for radius in RADII:
+        plan = plan_map(neighbours, sizes, budget, radius)
+        stats = simulate(plan, sizes, budget, walk)
+        print(
+            f"{radius:<8}{stats.hits:>6}{stats.misses:>8}{stats.prefetched:>12}"
+            f"{stats.evicted:>9}{stats.peak_bytes + core_bytes:>10}"
+        )
+    if args.plan:
+        plan = plan_map(neighbours, sizes, budget)
+        with open(args.plan, "w") as plan_f:
+            json.dump(
+                {names[level]: entry for level, entry in plan.items()},
+                plan_f,
+                indent=1,
+            )
+
+
+if __name__ == "__main__":
+    main()
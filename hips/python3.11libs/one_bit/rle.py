@@ -0,0 +1,130 @@
+import base64
+
+import numpy
+
+from one_bit import bitpack
+
+# Per row PackBits compression of packed 1-bit bitmaps.
+#
+# Each row (rowbytes long) is compressed on its own, so a decoder can unpack
+# straight into the rows of a bitmap. A row is a sequence of packets with a
+# signed header byte n:
+#   0 <= n <= 127    n + 1 literal bytes follow
+#   -127 <= n <= -1  the next byte repeats 1 - n times
+#   -128             no-op (never written)
+#
+# Mostly empty sprites and masks are long runs of 0x00 / 0xff so they shrink
+# a lot, noisy dithered images don't and are kept raw.
+#
+# ENCODING_XOR_DELTA is PackBits of the XOR against the previous bitmap, see
+# one_bit.delta
+
+ENCODING_RAW = 0
+ENCODING_PACKBITS = 1
+ENCODING_XOR_DELTA = 2
+
+MIN_RUN = 3
+MAX_PACKET = 128
+
+
+def packbits_row(row):
+    # row is a 1D uint8 array. Find the runs with numpy, then only loop over
+    # the runs instead of every byte.
+    row = numpy.asarray(row, dtype=numpy.uint8)
+    starts = numpy.flatnonzero(numpy.diff(row)) + 1
+    starts = numpy.concatenate(([0], starts))
+    lengths = numpy.diff(numpy.concatenate((starts, [row.size])))
+
+    out = bytearray()
+    literal_start = None
+
+    def flush_literal(end):
+        start = literal_start
+        while start < end:
+            count = min(MAX_PACKET, end - start)
+            out.append(count - 1)
+            out.extend(row[start : start + count].tobytes())
+            start += count
+
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        if length < MIN_RUN:
+            if literal_start is None:
+                literal_start = start
+            continue
+        if literal_start is not None:
+            flush_literal(start)
+            literal_start = None
+        value = int(row[start])
+        while length > 0:
+            count = min(MAX_PACKET, length)
+            if count < MIN_RUN:
+                # Too short to be worth a run, leave it as a literal
+                out.append(count - 1)
+                out.extend(bytes([value]) * count)
+            else:
+                out.append((1 - count) & 0xFF)
+                out.append(value)
+            length -= count
+
+    if literal_start is not None:
+        flush_literal(row.size)
+    return bytes(out)
+
+
+def packbits_rows(packed):
+    # packed is a (resy, rowbytes) array as from bitpack.pack_voxels
+    return b"".join(packbits_row(row) for row in packed)
+
+
+def unpackbits_rows(data, rowbytes, resy):
+    # Reference decoder, a straight port of what a Playdate side decoder does
+    out = bytearray(rowbytes * resy)
+    src = 0
+    dst = 0
+    while src < len(data):
+        n = data[src]
+        src += 1
+        if n < 128:
+            count = n + 1
+            if src + count > len(data) or dst + count > len(out):
+                raise ValueError("Corrupt PackBits data")
+            out[dst : dst + count] = data[src : src + count]
+            src += count
+        elif n > 128:
+            count = 257 - n
+            if src >= len(data) or dst + count > len(out):
+                raise ValueError("Corrupt PackBits data")
+            out[dst : dst + count] = bytes([data[src]]) * count
+            src += 1
+        else:
+            continue
+        dst += count
+    if dst != len(out):
+        raise ValueError(f"PackBits data decoded to {dst} of {len(out)} bytes")
+    return bytes(out)
+
+
+def decode_bitmap(encoded, res, encoding):
+    # base64 img / img_mask string to the raw padded rows
+    data = base64.urlsafe_b64decode(encoded)
+    if encoding == ENCODING_PACKBITS:
+        return unpackbits_rows(data, bitpack.row_bytes(res[0]), res[1])
+    return data
+
+
+def compress_bitmap(res, img, img_mask):
+    # Returns (img, img_mask, encoding) using PackBits only when it's smaller
+    # than the raw bits for the img and mask combined.
+    rowbytes = bitpack.row_bytes(res[0])
+    raw = [img] if img_mask is None else [img, img_mask]
+    compressed = []
+    for encoded in raw:
+        packed = numpy.frombuffer(base64.urlsafe_b64decode(encoded), numpy.uint8)
+        rows = packbits_rows(packed.reshape(res[1], rowbytes))
+        compressed.append(str(base64.urlsafe_b64encode(rows), "ascii"))
+
+    if sum(len(c) for c in compressed) >= sum(len(r) for r in raw):
+        return img, img_mask, ENCODING_RAW
+    if img_mask is None:
+        compressed.append(None)
+    return compressed[0], compressed[1], ENCODING_PACKBITS
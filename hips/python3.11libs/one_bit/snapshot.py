@@ -0,0 +1,78 @@
+import numpy
+
+# Column snapshots of multiparm blocks.
+#
+# The multiparms are fetched in one go (see otls/multiparms.py) as a list of
+# {"parm#" : value} rows, the same layout as the hda_parms detail, and turned
+# into one typed array per parm. Exporters then work on whole columns instead
+# of evaluating every parm of every instance through HOM.
+#
+# columns is a dict of {"parm#" : (dtype, size)}, size being the parm tuple
+# size. dtype object keeps the values as is (strings, node paths, ...).
+
+ELEMENT_COLUMNS = {
+    "bitmap_id#": (numpy.int32, 1),
+    "position#": (numpy.int32, 2),
+    "depth#": (numpy.int32, 1),
+    "frame_offset#": (numpy.int32, 1),
+    "flip#": (bool, 1),
+}
+
+COLLIDER_COLUMNS = {
+    "collider_type#": (numpy.int32, 1),
+    "collider_color#": (numpy.float32, 3),
+    "collider_pos#": (numpy.int32, 2),
+    "collider_size#": (numpy.int32, 2),
+}
+
+BITMAP_COLUMNS = {
+    "soppath#": (object, 1),
+    "mask#": (bool, 1),
+    "static#": (bool, 1),
+    "framerange#": (numpy.int32, 2),
+}
+
+CONNECTION_COLUMNS = {
+    "level_a#": (object, 1),
+    "placement#": (numpy.int32, 1),
+    "level_b#": (object, 1),
+}
+
+
+class MultiparmSnapshot:
+    def __init__(self, rows, columns):
+        self.columns = {}
+        for name, (dtype, size) in columns.items():
+            values = [row[name] for row in rows]
+            shape = (len(rows),) if size == 1 else (len(rows), size)
+            if dtype is object:
+                column = numpy.empty(shape, dtype=object)
+                column[:] = values
+            else:
+                column = numpy.array(values, dtype=dtype).reshape(shape)
+            self.columns[name] = column
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, values):
+        self.columns[name][:] = values
+
+    def rows(self, *names):
+        # Yields a tuple of plain Python values per instance, vector parms
+        # are lists
+        return zip(*(self.columns[name].tolist() for name in names))
+
+    def take(self, order):
+        # A copy reordered (or filtered) by the instance indices in order
+        taken = MultiparmSnapshot([], {})
+        taken.columns = {name: column[order] for name, column in self.columns.items()}
+        return taken
+
+    def as_rows(self):
+        # Back to {"parm#" : value} rows, to write the instances back
+        names = list(self.columns)
+        return [dict(zip(names, values)) for values in self.rows(*names)]
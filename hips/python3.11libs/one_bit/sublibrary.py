@@ -0,0 +1,248 @@
+import argparse
+import base64
+import bisect
+import copy
+import json
+import os
+
+from one_bit import binary_library
+from one_bit import bitpack
+from one_bit import json_stream
+from one_bit import library
+
+# Splits a bitmap library into a shared "core" library and a chunk library
+# per level, so only the bitmaps of the current level have to be resident:
+#
+#   python -m one_bit.sublibrary ../../assets/library.json \
+#       ../../assets/levels/*.json --out world
+#
+# Groups (every frame of a bitmap_library entry) are never split, so the
+# frames of an animated sprite keep consecutive ids and the deltas of a
+# group keep their base. Groups used by min_levels levels or more are
+# hoisted into the core, the others go into the chunk of the only level
+# using them, groups no level uses are dropped.
+#
+# Resident ids are the core bitmaps followed by the chunk of the current
+# level, the exported levels are rewritten with those ids. Every chunk
+# library has two extra entries along with ".total_sprites.":
+#   {".first_id." : int}     resident id of its first bitmap
+#   {".remap." : [[old_id, new_id, count], ...]}   per group
+#
+# A bitmap_ref holds the resident id of the bitmap it refers to, in the
+# core or in the same chunk, so refs into the core stay refs. A bitmap_ref to
+# a bitmap in the chunk of another level (or in a dropped group) is written
+# out as a full (raw) copy of the bitmap it refers to.
+
+DEFAULT_MIN_LEVELS = 2
+
+
+def group_ranges(lib):
+    # (sop_path, metadata, bitmaps, first flat id) per group
+    ranges = []
+    first_id = 0
+    for sop_path, metadata, bitmaps in library.iter_groups(lib):
+        ranges.append((sop_path, metadata, bitmaps, first_id))
+        first_id += len(bitmaps)
+    return ranges
+
+
+def level_sprites(level):
+    _, sprites = level["level_data"].get("sprites", [{}, []])
+    return [sprite["sprite"] for sprite in sprites]
+
+
+def level_groups(level, starts):
+    # Indices of the groups the sprites of a level use
+    return {
+        bisect.bisect_right(starts, sprite["bitmap_id"]) - 1
+        for sprite in level_sprites(level)
+    }
+
+
+def encode_bits(data):
+    return str(base64.urlsafe_b64encode(data), "ascii")
+
+
+def raw_entry(dims):
+    # A decoded (width, height, rowbytes, img, mask) as an uncompressed entry
+    width, height, _, img, mask = dims
+    return {
+        "bitmap": [
+            {"spec": [width, height, mask is not None]},
+            {"img": encode_bits(img)},
+            {"img_mask": None if mask is None else encode_bits(mask)},
+        ]
+    }
+
+
+def entry_bytes(entry, dims):
+    # Resident bytes of an entry, refs share the LCDBitmap they refer to
+    if "bitmap_ref" in entry:
+        return 0
+    _, height, rowbytes, _, mask = dims
+    return rowbytes * height * (1 if mask is None else 2)
+
+
+def build_chunk(ranges, group_indices, first_id, dims, core_ids=None):
+    # Returns the library of the groups starting at resident id first_id,
+    # {old first id : new first id} per group, its resident bytes and the
+    # resident id of every old flat id in it. core_ids are the latter for
+    # the core, resident along with the chunk.
+    core_ids = core_ids or {}
+    groups = []
+    remap = {}
+    remap_table = []
+    local = {}
+    resident = 0
+    new_id = first_id
+    for index in sorted(group_indices):
+        sop_path, metadata, bitmaps, old_first = ranges[index]
+        remap[old_first] = new_id
+        remap_table.append([old_first, new_id, len(bitmaps)])
+        entries = []
+        for old_id, entry in enumerate(bitmaps, old_first):
+            local[old_id] = new_id
+            if "bitmap_ref" in entry:
+                ref = entry["bitmap_ref"]
+                if ref in local:
+                    entry = {"bitmap_ref": local[ref]}
+                elif ref in core_ids:
+                    entry = {"bitmap_ref": core_ids[ref]}
+                else:
+                    entry = raw_entry(dims[old_id])
+            resident += entry_bytes(entry, dims[old_id])
+            entries.append(entry)
+            new_id += 1
+        groups.append({sop_path: [{"metadata": metadata}, {"bitmaps": entries}]})
+    chunk = {
+        "bitmap_library": [
+            {".total_sprites.": new_id - first_id},
+            {".first_id.": first_id},
+            {".remap.": remap_table},
+            *groups,
+        ]
+    }
+    return chunk, remap, resident, local
+
+
+def remap_level(level, remap, starts):
+    # Copy of a level with the sprites using resident ids
+    level = copy.deepcopy(level)
+    for sprite in level_sprites(level):
+        old_first = starts[bisect.bisect_right(starts, sprite["bitmap_id"]) - 1]
+        sprite["bitmap_id"] = remap[old_first] + sprite["bitmap_id"] - old_first
+    return level
+
+
+def background_bytes(level):
+    background = level["level_data"].get("background")
+    if background is None:
+        return 0
+    rows = bitpack.row_bytes(background["resx"]) * background["resy"]
+    return rows * (2 if background.get("has_mask") else 1)
+
+
+def split_library(lib, levels, min_levels=DEFAULT_MIN_LEVELS):
+    # Returns the core library, {level name : (chunk library, remapped
+    # level)} and the report
+    if any(".atlas." in entry for entry in lib["bitmap_library"]):
+        raise binary_library.LibraryFormatError(
+            "Atlas libraries can't be split, the sheets are shared"
+        )
+    ranges = group_ranges(lib)
+    starts = [first_id for _, _, _, first_id in ranges]
+    dims = {}
+    for _ in binary_library.iter_records(library.iter_bitmaps(lib), dims):
+        pass
+
+    used = {level[".level_name."]: level_groups(level, starts) for level in levels}
+    users = [0] * len(ranges)
+    for groups in used.values():
+        for index in groups:
+            users[index] += 1
+    core_groups = {i for i, count in enumerate(users) if count >= min_levels}
+    core, core_remap, core_bytes, core_ids = build_chunk(
+        ranges, core_groups, 0, dims
+    )
+    core_size = core["bitmap_library"][0][".total_sprites."]
+
+    full_bytes = sum(
+        entry_bytes(entry, dims[bitmap_id])
+        for bitmap_id, entry in enumerate(library.iter_bitmaps(lib))
+    )
+    report = {
+        "groups": len(ranges),
+        "core_groups": len(core_groups),
+        "unused_groups": users.count(0),
+        "core_bitmaps": core_size,
+        "core_bytes": core_bytes,
+        "full_bytes": full_bytes,
+        "levels": {},
+    }
+    chunks = {}
+    for level in levels:
+        name = level[".level_name."]
+        chunk, remap, chunk_bytes, _ = build_chunk(
+            ranges, used[name] - core_groups, core_size, dims, core_ids
+        )
+        chunks[name] = (chunk, remap_level(level, {**core_remap, **remap}, starts))
+        level_bytes = background_bytes(level)
+        report["levels"][name] = {
+            "chunk_bitmaps": chunk["bitmap_library"][0][".total_sprites."],
+            "chunk_bytes": chunk_bytes,
+            "background_bytes": level_bytes,
+            "peak_bytes": core_bytes + chunk_bytes + level_bytes,
+        }
+    return core, chunks, report
+
+
+def print_report(report):
+    print(
+        f"core: {report['core_groups']} of {report['groups']} groups, "
+        f"{report['core_bitmaps']} bitmaps, {report['core_bytes']} bytes "
+        f"({report['unused_groups']} unused groups dropped)"
+    )
+    print(f"{'level':<24}{'bitmaps':>8}{'chunk':>10}{'bg':>8}{'peak':>10}")
+    for name, level in report["levels"].items():
+        print(
+            f"{name:<24}{level['chunk_bitmaps']:>8}{level['chunk_bytes']:>10}"
+            f"{level['background_bytes']:>8}{level['peak_bytes']:>10}"
+        )
+    peak = max(
+        (level["peak_bytes"] for level in report["levels"].values()), default=0
+    )
+    print(f"peak resident {peak} bytes, whole library {report['full_bytes']} bytes")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Per level bitmap libraries")
+    parser.add_argument("library", help="library.json the levels were built with")
+    parser.add_argument("levels", nargs="+", help="exported level json files")
+    parser.add_argument("--out", required=True, help="directory to write to")
+    parser.add_argument("--min-levels", type=int, default=DEFAULT_MIN_LEVELS)
+    parser.add_argument("--report", help="write the report as json")
+    args = parser.parse_args(args)
+
+    with open(args.library) as lib_f:
+        lib = json.load(lib_f)
+    levels = []
+    for level_path in args.levels:
+        with open(level_path) as level_f:
+            levels.append(json.load(level_f))
+    core, chunks, report = split_library(lib, levels, args.min_levels)
+
+    os.makedirs(os.path.join(args.out, "levels"), exist_ok=True)
+    json_stream.dump_file(core, os.path.join(args.out, "core.json"))
+    for name, (chunk, level) in chunks.items():
+        json_stream.dump_file(chunk, os.path.join(args.out, f"{name}.json"))
+        json_stream.dump_file(
+            level, os.path.join(args.out, "levels", f"{name}.json")
+        )
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as report_f:
+            json.dump(report, report_f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
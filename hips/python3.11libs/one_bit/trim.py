@@ -0,0 +1,83 @@
+import numpy
+
+# Trimming of the transparent border around masked bitmaps.
+#
+# Bitmaps are often authored on a fixed canvas (ie 64x64) with a lot of
+# empty space around the visible pixels. The tight box around the mask is
+# found per bitmap group, (the union over every frame for animated groups so
+# the sequence doesn't jitter) and only those pixels are exported. The
+# origin of the box is stored so the level export can shift the sprites and
+# keep them where they were on screen.
+#
+# Volumes are stored bottom row first (the Playdate flips them in Y), so a
+# box is (col_min, row_min, col_max, row_max) in voxel space, max exclusive.
+#
+# Unmasked bitmaps are drawn as opaque rectangles, there is nothing to trim
+# without changing what ends up on screen so they are left alone.
+
+
+def _as_array(voxels, res):
+    return numpy.frombuffer(voxels, dtype=numpy.float32).reshape(res[1], res[0])
+
+
+def opaque_box(mask_frames, res):
+    # Union of the non zero voxels over every frame, None when fully empty
+    coverage = numpy.zeros((res[1], res[0]), dtype=bool)
+    for voxels in mask_frames:
+        coverage |= _as_array(voxels, res) != 0
+    cols = numpy.flatnonzero(coverage.any(axis=0))
+    rows = numpy.flatnonzero(coverage.any(axis=1))
+    if not cols.size:
+        return None
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def box_res(box):
+    return (box[2] - box[0], box[3] - box[1])
+
+
+def crop_voxels(voxels, res, box):
+    cropped = _as_array(voxels, res)[box[1] : box[3], box[0] : box[2]]
+    return numpy.ascontiguousarray(cropped).tobytes()
+
+
+def screen_origin(box, res):
+    # Offset of the trimmed bitmap's top left corner within the canvas, as
+    # drawn on the Playdate (ie after the Y flip)
+    return [box[0], res[1] - box[3]]
+
+
+def sprite_offset(origin, canvas, trimmed_res, flip):
+    # How much to move a sprite placed for the full canvas so the trimmed
+    # bitmap lands on the same pixels, a flipped sprite mirrors within its
+    # own (now smaller) rect.
+    offset_x = origin[0]
+    if flip:
+        offset_x = canvas[0] - trimmed_res[0] - origin[0]
+    return offset_x, origin[1]
+
+
+def trim_frames(frames):
+    # frames is a list of (frame, res, img_voxels, mask_voxels) for a single
+    # bitmap group. Returns the cropped frames and the (origin, canvas) or
+    # None when the group can't or doesn't need to be trimmed.
+    if not frames or any(f[3] is None for f in frames):
+        return frames, None
+    res = frames[0][1]
+    if any(f[1] != res for f in frames):
+        return frames, None
+    box = opaque_box([f[3] for f in frames], res)
+    if box is None or box_res(box) == tuple(res):
+        return frames, None
+
+    trimmed = box_res(box)
+    cropped = [
+        (
+            frame,
+            trimmed,
+            crop_voxels(img_voxels, res, box),
+            crop_voxels(mask_voxels, res, box),
+        )
+        for frame, _, img_voxels, mask_voxels in frames
+    ]
+    return cropped, (screen_origin(box, res), list(res))
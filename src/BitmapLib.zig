@@ -6,6 +6,8 @@ const debug = if (builtin.mode == .Debug and enable_debug) true else false;
 const BitmapLib = @This();
 
 bitmaps: []*pdapi.LCDBitmap = &.{},
+// Set for the deduplicated entries (bitmap_ref), they share the LCDBitmap of an earlier entry
+shared: []bool = &.{},
 playdate: *const pdapi.PlaydateAPI,
 
 pub fn init(playdate: *const pdapi.PlaydateAPI) *BitmapLib {
@@ -17,11 +19,14 @@ pub fn init(playdate: *const pdapi.PlaydateAPI) *BitmapLib {
 }
 
 pub fn deinit(self: *BitmapLib) void {
-    for (self.bitmaps) |bitmap| {
+    for (self.bitmaps, self.shared) |bitmap, shared| {
+        if (shared) continue;
         self.playdate.graphics.freeBitmap(bitmap);
     }
-    self.bitmaps = &.{};
     _ = self.playdate.system.realloc(self.bitmaps.ptr, 0);
+    _ = self.playdate.system.realloc(self.shared.ptr, 0);
+    self.bitmaps = &.{};
+    self.shared = &.{};
 }
 
 pub const BitmapLibParser = struct {
@@ -29,6 +34,8 @@ pub const BitmapLibParser = struct {
     resx: c_int = 0,
     resy: c_int = 0,
     has_mask: bool = false,
+    // The mask is identical to the img and isn't stored (see one_bit/masks.py)
+    mask_from_img: bool = false,
     bitlib: *BitmapLib,
     added_bitmaps: usize = 0,
 
@@ -46,6 +53,7 @@ pub const BitmapLibParser = struct {
 
         if (jtype == .JSONArray and std.mem.eql(u8, "spec", std.mem.sliceTo(name.?, 0))) {
             jstate.in_spec = true;
+            jstate.mask_from_img = false;
         } else {
             jstate.in_spec = false;
         }
@@ -81,6 +89,12 @@ pub const BitmapLibParser = struct {
                 @intCast(@sizeOf(*pdapi.LCDBitmap) * (value.data.intval)),
             ) orelse unreachable));
             bitlib.bitmaps = bitmaps_ptr[0..@intCast(value.data.intval)];
+            const shared_ptr: [*]bool = @ptrCast(pd.system.realloc(
+                null,
+                @intCast(@sizeOf(bool) * (value.data.intval)),
+            ) orelse unreachable);
+            bitlib.shared = shared_ptr[0..@intCast(value.data.intval)];
+            @memset(bitlib.shared, false);
             jstate.added_bitmaps = 0;
             if (debug) pd.system.logToConsole("len of bitlibs %d", bitlib.bitmaps.len);
         } else if (std.mem.eql(u8, "img", key_name)) {
@@ -110,11 +124,23 @@ pub const BitmapLibParser = struct {
                     pd.system.logToConsole("Failed to decode %s", key);
                     return;
                 };
-                jstate.addMap(bitmap) catch {
+                if (jstate.has_mask and jstate.mask_from_img and mask != null) {
+                    @memcpy(mask[0..@intCast(row_bytes * image_height)], data[0..@intCast(row_bytes * image_height)]);
+                }
+                jstate.addMap(bitmap, false) catch {
                     _ = pd.graphics.freeBitmap(bitmap);
                     pd.system.logToConsole("Bitmap Library Full");
                 };
             }
+        } else if (std.mem.eql(u8, "bitmap_ref", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+            // A duplicate of an already added bitmap, share it instead of allocating a new one.
+            if (value.data.intval < 0 or @as(usize, @intCast(value.data.intval)) >= jstate.added_bitmaps) {
+                pd.system.logToConsole("ERROR: Invalid bitmap_ref %d", value.data.intval);
+                return;
+            }
+            jstate.addMap(bitlib.bitmaps[@intCast(value.data.intval)], true) catch {
+                pd.system.logToConsole("Bitmap Library Full");
+            };
         } else if (std.mem.eql(u8, "img_mask", key_name)) {
             pd.graphics.getBitmapData(
                 bitlib.bitmaps[jstate.added_bitmaps - 1],
@@ -156,6 +182,7 @@ pub const BitmapLibParser = struct {
                 1 => jstate.resx = value.data.intval,
                 2 => jstate.resy = value.data.intval,
                 3 => jstate.has_mask = (value.type == @intFromEnum(pdapi.JSONValueType.JSONTrue)),
+                5 => jstate.mask_from_img = (value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger) and value.data.intval == 2),
                 else => return,
             }
         }
@@ -172,11 +199,12 @@ pub const BitmapLibParser = struct {
         return null;
     }
 
-    pub fn addMap(self: *BitmapLibParser, bitmap: *pdapi.LCDBitmap) error{LibraryFull}!void {
+    pub fn addMap(self: *BitmapLibParser, bitmap: *pdapi.LCDBitmap, shared: bool) error{LibraryFull}!void {
         if (debug) self.bitlib.playdate.system.logToConsole("Adding bitmap: %d", self.bitlib.bitmaps.len);
         if (self.added_bitmaps + 1 > self.bitlib.bitmaps.len) return error.LibraryFull;
         self.added_bitmaps += 1;
         self.bitlib.bitmaps[self.added_bitmaps - 1] = bitmap;
+        self.bitlib.shared[self.added_bitmaps - 1] = shared;
     }
 
     pub fn buildLibrary(self: *BitmapLibParser, library_src: JsonSource) void {
@@ -12,6 +12,8 @@ const Level = @This();
 
 colliders: []*pdapi.LCDSprite = &.{},
 sprites: []*pdapi.LCDSprite = &.{},
+// Static sprites baked into a single bitmap at export, owns its bitmap
+background: ?*pdapi.LCDSprite = null,
 // TODO: Given that we have to have a global playdate pointer, we can probably remove this
 playdate: *const pdapi.PlaydateAPI,
 bitlib: *const BitmapLib,
@@ -42,13 +44,23 @@ pub fn deinit(self: *Level) void {
         self.playdate.sprite.freeSprite(sprite);
         // TODO check if this leaks the bitmap's memory
     }
+    if (self.background) |background| {
+        self.playdate.sprite.removeSprite(background);
+        self.playdate.graphics.freeBitmap(self.playdate.sprite.getImage(background));
+        self.playdate.sprite.freeSprite(background);
+    }
     _ = self.playdate.system.realloc(self.sprites.ptr, 0);
     _ = self.playdate.system.realloc(self.colliders.ptr, 0);
     self.sprites = &.{};
     self.colliders = &.{};
+    self.background = null;
 }
 
 pub fn populate(self: *const Level) void {
+    // Added first so it stays below the sprites sharing its depth
+    if (self.background) |background| {
+        self.playdate.sprite.addSprite(background);
+    }
     for (self.sprites) |sprite| {
         self.playdate.sprite.addSprite(sprite);
     }
@@ -58,21 +70,46 @@ pub fn populate(self: *const Level) void {
 }
 
 pub fn clear(self: *const Level) void {
+    if (self.background) |background| {
+        self.playdate.sprite.removeSprite(background);
+    }
     self.playdate.sprite.removeSprites(@ptrCast(self.sprites.ptr), @intCast(self.sprites.len));
     self.playdate.sprite.removeSprites(@ptrCast(self.colliders.ptr), @intCast(self.colliders.len));
 }
 
+// Max number of held frames per sprite, see LevelParser.holds
+const max_holds = 256;
+
 const LoopingSprite = struct {
     id: i16,
     duration: i16,
     frame_offset: i16,
     bitlib: *const BitmapLib,
+    // Held frames, how many ticks each frame is shown for. The holds are stored
+    // right after the struct in the same allocation so they get freed with the
+    // userdata. When num_holds is 0 every frame is shown for a single tick.
+    num_holds: usize = 0,
+    hold_left: u8 = 0,
+
+    fn heldFrames(self: *LoopingSprite) []u8 {
+        const base: [*]u8 = @ptrCast(self);
+        return (base + @sizeOf(LoopingSprite))[0..self.num_holds];
+    }
 
     fn loopAnimation(sprite: ?*pdapi.LCDSprite) callconv(.C) void {
         const playdate = global_playdate_ptr orelse return;
         const userdata = playdate.sprite.getUserdata(sprite) orelse return;
         const loop_state: *LoopingSprite = @ptrCast(@alignCast(userdata));
+        const holds = loop_state.heldFrames();
+        if (holds.len != 0) {
+            // Nothing to swap while the frame is held
+            if (loop_state.hold_left > 1) {
+                loop_state.hold_left -= 1;
+                return;
+            }
+        }
         loop_state.frame_offset = @rem(loop_state.frame_offset + 1, loop_state.duration);
+        if (holds.len != 0) loop_state.hold_left = holds[@intCast(loop_state.frame_offset)];
         playdate.sprite.setImage(
             sprite,
             loop_state.bitlib.bitmaps[@intCast(loop_state.id + loop_state.frame_offset)],
@@ -84,6 +121,7 @@ const LoopingSprite = struct {
 const SpriteType = enum {
     sprite,
     collider,
+    background,
     none,
 };
 
@@ -107,16 +145,32 @@ const SpritePlacement = struct {
     duration: i16 = 1,
     flip: bool = false,
     animated: bool = false,
+    // Ticks per frame, parsed into LevelParser.holds, only used when there
+    // is one per frame (num_holds == duration)
+    num_holds: usize = 0,
+};
+
+const BackgroundPlacement = struct {
+    pos: Position = .{},
+    depth: i16 = 0,
+    resx: c_int = 0,
+    resy: c_int = 0,
+    has_mask: bool = false,
+    // Created when the img is decoded, resx, resy and has_mask come first
+    bitmap: ?*pdapi.LCDBitmap = null,
 };
 
 const ParsedSprite = union(SpriteType) {
     sprite: SpritePlacement,
     collider: ColliderPlacement,
+    background: BackgroundPlacement,
     none: void,
 };
 
 pub const LevelParser = struct {
     in_position: bool = false,
+    in_holds: bool = false,
+    holds: [max_holds]u8 = undefined,
     parsed_sprite: ParsedSprite = .{ .none = {} },
     level: *Level,
     added_sprites: usize = 0,
@@ -138,10 +192,14 @@ pub const LevelParser = struct {
         const key_name = std.mem.sliceTo(name orelse return, 0);
         if (jtype == .JSONArray and std.mem.eql(u8, "position", key_name)) {
             jstate.in_position = true;
+        } else if (jtype == .JSONArray and std.mem.eql(u8, "holds", key_name)) {
+            jstate.in_holds = true;
         } else if (jtype == .JSONTable and std.mem.eql(u8, "sprite", key_name)) {
             jstate.parsed_sprite = .{ .sprite = .{} };
         } else if (jtype == .JSONTable and std.mem.eql(u8, "collider", key_name)) {
             jstate.parsed_sprite = .{ .collider = .{} };
+        } else if (jtype == .JSONTable and std.mem.eql(u8, "background", key_name)) {
+            jstate.parsed_sprite = .{ .background = .{} };
         }
     }
 
@@ -209,11 +267,57 @@ pub const LevelParser = struct {
                         c.resy = @intCast(value.data.intval);
                     }
                 },
+                .background => |*b| {
+                    if (std.mem.eql(u8, "depth", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+                        b.depth = @intCast(value.data.intval);
+                    } else if (std.mem.eql(u8, "resx", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+                        b.resx = @intCast(value.data.intval);
+                    } else if (std.mem.eql(u8, "resy", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+                        b.resy = @intCast(value.data.intval);
+                    } else if (std.mem.eql(u8, "has_mask", key_name)) {
+                        b.has_mask = (value.type == @intFromEnum(pdapi.JSONValueType.JSONTrue));
+                    } else if (std.mem.eql(u8, "img", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONString)) {
+                        const bitmap = pd.graphics.newBitmap(
+                            b.resx,
+                            b.resy,
+                            if (b.has_mask) @intFromEnum(pdapi.LCDSolidColor.ColorClear) else @intFromEnum(pdapi.LCDSolidColor.ColorBlack),
+                        ) orelse return;
+                        if (!decodeBits(pd, bitmap, std.mem.sliceTo(value.data.stringval, 0), false)) {
+                            pd.system.logToConsole("ERROR: Failed to decode the background");
+                            pd.graphics.freeBitmap(bitmap);
+                            return;
+                        }
+                        b.bitmap = bitmap;
+                    } else if (std.mem.eql(u8, "img_mask", key_name) and value.type == @intFromEnum(pdapi.JSONValueType.JSONString)) {
+                        const bitmap = b.bitmap orelse return;
+                        if (!decodeBits(pd, bitmap, std.mem.sliceTo(value.data.stringval, 0), true)) {
+                            pd.system.logToConsole("ERROR: Failed to decode the background mask");
+                        }
+                    }
+                },
                 .none => return,
             }
         }
     }
 
+    // Decodes base64 bits into the data (or mask) of a bitmap, the size has to
+    // match the padded rows of the bitmap exactly
+    fn decodeBits(pd: *const pdapi.PlaydateAPI, bitmap: *pdapi.LCDBitmap, encoded: []const u8, into_mask: bool) bool {
+        var width: c_int = 0;
+        var height: c_int = 0;
+        var row_bytes: c_int = 0;
+        var mask: [*c]u8 = null;
+        var data: [*c]u8 = null;
+        pd.graphics.getBitmapData(bitmap, &width, &height, &row_bytes, &mask, &data);
+        const dest = if (into_mask) mask else data;
+        if (dest == null) return false;
+        const size: usize = @intCast(row_bytes * height);
+        const decode_size = std.base64.url_safe.Decoder.calcSizeForSlice(encoded) catch return false;
+        if (decode_size != size) return false;
+        std.base64.url_safe.Decoder.decode(dest[0..size], encoded) catch return false;
+        return true;
+    }
+
     //fn shouldDecodeArrayValueAtIndex(decoder: ?*pdapi.JSONDecoder, pos: c_int) callconv(.C) c_int {}
 
     fn didDecodeArrayValue(decoder: ?*pdapi.JSONDecoder, pos: c_int, value: pdapi.JSONValue) callconv(.C) void {
@@ -221,7 +325,19 @@ pub const LevelParser = struct {
         const level = jstate.level;
         const pd = level.playdate;
         if (debug) pd.system.logToConsole("didDecodeArrayValue: %d", pos);
-        if (jstate.in_position and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+        if (jstate.in_holds and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
+            switch (jstate.parsed_sprite) {
+                .sprite => |*s| {
+                    if (pos < 1 or pos > max_holds) {
+                        pd.system.logToConsole("ERROR: Too many held frames, max %d", @as(c_int, max_holds));
+                        return;
+                    }
+                    jstate.holds[@intCast(pos - 1)] = @intCast(std.math.clamp(value.data.intval, 1, 255));
+                    s.num_holds = @max(s.num_holds, @as(usize, @intCast(pos)));
+                },
+                else => return,
+            }
+        } else if (jstate.in_position and value.type == @intFromEnum(pdapi.JSONValueType.JSONInteger)) {
             switch (pos) {
                 //1 => jstate.sprite_placement.pos.x = @truncate(value.data.intval),
                 //2 => jstate.sprite_placement.pos.y = @truncate(value.data.intval),
@@ -268,8 +384,18 @@ pub const LevelParser = struct {
                 },
                 else => return null,
             }
+        } else if (std.mem.eql(u8, "background", key_name)) {
+            switch (jstate.parsed_sprite) {
+                .background => |b| {
+                    jstate.createBackground(b);
+                    jstate.parsed_sprite = .{ .none = {} };
+                },
+                else => return null,
+            }
         } else if (std.mem.eql(u8, "position", key_name)) {
             jstate.in_position = false;
+        } else if (std.mem.eql(u8, "holds", key_name)) {
+            jstate.in_holds = false;
         }
         return null;
     }
@@ -301,14 +427,24 @@ pub const LevelParser = struct {
         pd.sprite.setSize(sprite, @floatFromInt(img_width), @floatFromInt(img_height));
         pd.sprite.setZIndex(sprite, placement.depth);
         if (placement.animated) {
+            var num_holds = placement.num_holds;
+            if (num_holds != 0 and num_holds != placement.duration) {
+                pd.system.logToConsole("ERROR: %d held frames for a duration of %d", @as(c_int, @intCast(num_holds)), @as(c_int, placement.duration));
+                num_holds = 0;
+            }
             // TODO check return ptr
-            const loop_state: *LoopingSprite = @ptrCast(@alignCast(pd.system.realloc(null, @sizeOf(LoopingSprite))));
+            const loop_state: *LoopingSprite = @ptrCast(@alignCast(pd.system.realloc(null, @sizeOf(LoopingSprite) + num_holds)));
             loop_state.* = .{
                 .id = placement.id,
                 .duration = placement.duration,
                 .frame_offset = placement.frame_offset,
                 .bitlib = self.level.bitlib,
+                .num_holds = num_holds,
             };
+            if (num_holds != 0) {
+                @memcpy(loop_state.heldFrames(), self.holds[0..num_holds]);
+                loop_state.hold_left = loop_state.heldFrames()[offset];
+            }
             pd.sprite.setUserdata(sprite, @ptrCast(loop_state));
             pd.sprite.setUpdateFunction(sprite, LoopingSprite.loopAnimation);
         }
@@ -316,6 +452,30 @@ pub const LevelParser = struct {
         self.level.sprites[self.added_sprites - 1] = sprite;
     }
 
+    fn createBackground(self: *LevelParser, background: BackgroundPlacement) void {
+        const pd = self.level.playdate;
+        if (debug) pd.system.logToConsole("Creating Background");
+
+        const bitmap = background.bitmap orelse {
+            pd.system.logToConsole("ERROR: Background without a bitmap");
+            return;
+        };
+        if (self.level.background != null) {
+            pd.system.logToConsole("ERROR: Level already has a background");
+            pd.graphics.freeBitmap(bitmap);
+            return;
+        }
+        const sprite = pd.sprite.newSprite() orelse unreachable;
+        pd.sprite.setImage(sprite, bitmap, .BitmapUnflipped);
+        // Stored bottom row first like the library bitmaps
+        pd.sprite.setImageFlip(sprite, .BitmapFlippedY);
+        pd.sprite.setCenter(sprite, 0.0, 0.0);
+        pd.sprite.moveTo(sprite, @floatFromInt(background.pos.x), @floatFromInt(background.pos.y));
+        pd.sprite.setSize(sprite, @floatFromInt(background.resx), @floatFromInt(background.resy));
+        pd.sprite.setZIndex(sprite, background.depth);
+        self.level.background = sprite;
+    }
+
     fn createCollider(self: *LevelParser, collider: ColliderPlacement) error{LevelFull}!void {
         if (self.added_colliders + 1 > self.level.colliders.len) return error.LevelFull;
         const pd = self.level.playdate;